@@ -0,0 +1,151 @@
+import sys
+import numpy as np
+from solid import scad_render_to_file
+from solid.utils import translate, union, color, linear_extrude, text
+
+from camera_event import clean_mask, pixel_colours, camera_image
+from event_record import calibrated_events
+
+
+class PixelAccumulator(object):
+    """
+    Running per-pixel statistics of one telescope over a run.
+    Everything is updated in place, so the memory does not depend on the number of events:
+        - mean and variance of the calibrated charge (Welford)
+        - maximum charge
+        - number of events in which the pixel survives the tailcut cleaning
+    """
+    __slots__ = ('n_events', 'mean', 'm2', 'max', 'n_pass', '_delta')
+
+    def __init__(self, n_pixels):
+        self.n_events = 0
+        self.mean = np.zeros(n_pixels)
+        self.m2 = np.zeros(n_pixels)
+        self.max = np.full(n_pixels, -np.inf)
+        self.n_pass = np.zeros(n_pixels, dtype=np.int64)
+        self._delta = np.zeros(n_pixels)
+
+    def update(self, image, mask):
+        """
+        Add one image to the statistics
+        :param image: calibrated image
+        :param mask: boolean mask of the pixels after the cleaning
+        """
+        self.n_events += 1
+        delta = self._delta
+        np.subtract(image, self.mean, out=delta)
+        self.mean += delta / self.n_events
+        # m2 += (x - old_mean) * (x - new_mean)
+        delta *= image - self.mean
+        self.m2 += delta
+        np.maximum(self.max, image, out=self.max)
+        self.n_pass += mask
+
+    def variance(self):
+        if self.n_events < 2:
+            return np.zeros_like(self.m2)
+        return self.m2 / (self.n_events - 1)
+
+    def pass_rate(self):
+        return self.n_pass / max(self.n_events, 1)
+
+    def hot_pixels(self, n_sigma=5.):
+        """
+        Pixels with a pass rate far above the rest of the camera: median + n_sigma * spread, where the
+        spread is the (scaled) median absolute deviation, never below the binomial error of the median rate.
+        :param n_sigma: threshold in units of the spread
+        :return: boolean mask of the hot pixels
+        """
+        rate = self.pass_rate()
+        median = np.median(rate)
+        mad = 1.4826 * np.median(np.abs(rate - median))
+        binomial = np.sqrt(median * (1 - median) / max(self.n_events, 1))
+        return rate > median + n_sigma * max(mad, binomial, 1. / max(self.n_events, 1))
+
+    def quantity(self, name):
+        """
+        :param name: 'mean', 'std', 'max', 'pass_rate' or 'hot'
+        :return: per-pixel values
+        """
+        if name == 'mean':
+            return self.mean
+        elif name == 'std':
+            return np.sqrt(self.variance())
+        elif name == 'max':
+            return self.max
+        elif name == 'pass_rate':
+            return self.pass_rate()
+        elif name == 'hot':
+            return self.hot_pixels().astype(float)
+        raise ValueError("unknown quantity: {0}".format(name))
+
+
+def aggregate_run(filename, allowed_tels=None, max_events=None):
+    """
+    Stream all the events of a simtel file through calibration and tailcut cleaning and
+    accumulate the per-pixel statistics of every telescope.
+    :param filename: simtel file
+    :param allowed_tels: set of telescope IDs. None for all the telescopes
+    :param max_events: maximum number of events. None for the full run
+    :return: dictionary {tel_id: PixelAccumulator}, subarray description
+    """
+    accumulators = {}
+    subarray = None
+    for event in calibrated_events(filename, allowed_tels, max_events):
+        subarray = event.inst.subarray
+        for tel_id in event.r0.tels_with_data:
+            image = event.dl1.tel[tel_id].image
+            if image is None:
+                continue
+            image = image[0]
+            camera = subarray.tel[tel_id].camera
+            if tel_id not in accumulators:
+                accumulators[tel_id] = PixelAccumulator(image.size)
+            accumulators[tel_id].update(image, clean_mask(camera, image))
+
+    return accumulators, subarray
+
+
+def draw_aggregate(accumulator, camera, quantity='mean', scale_cam=1.0):
+    """
+    Draw one per-pixel quantity of the accumulator on the camera, with the same colors as draw_camera
+    :param accumulator: PixelAccumulator of the telescope
+    :param camera: camera geometry
+    :param quantity: see PixelAccumulator.quantity
+    :param scale_cam: scale the whole camera to see it better
+    :return: camera display
+    """
+    values = accumulator.quantity(quantity)
+    mask = np.full(values.size, True)
+    # all zero (e.g. no event passes the cleaning): all the pixels get the color of zero
+    max_col = np.max(values) if np.max(values) > 0 else 1.
+    return camera_image(camera, pixel_colours(values, mask, max_col), scale_cam=scale_cam)
+
+
+def main(filename, quantity='mean'):
+    """
+    Aggregate the whole run and put the cameras one next to the other, each with its telescope ID.
+    """
+    accumulators, subarray = aggregate_run(filename)
+
+    cameras = union()
+    spacing = 600
+    for i, tel_id in enumerate(sorted(accumulators)):
+        camera = subarray.tel[tel_id].camera
+        if camera.cam_id not in ['LSTCam', 'NectarCam', 'FlashCam']:
+            continue
+        print("tel_id: {0}, events: {1}".format(tel_id, accumulators[tel_id].n_events))
+        display = draw_aggregate(accumulators[tel_id], camera, quantity=quantity)
+        display = display + translate([-200, -350, 0])(color([0, 0, 0])(linear_extrude(10)(text(text=str(tel_id), size=80))))
+        cameras.add(translate([i * spacing, 0, 0])(display))
+
+    file_out = 'aggregate_' + quantity + '.scad'
+    scad_render_to_file(cameras, file_out)
+
+
+if __name__ == '__main__':
+    filename = sys.argv[1]
+    if len(sys.argv) > 2:
+        main(filename, quantity=sys.argv[2])
+    else:
+        main(filename)
@@ -0,0 +1,152 @@
+import os
+import argparse
+import numpy as np
+from solid.utils import union
+
+from array_scene import telescope_camera_event, mc_details, colour_variable
+from camera_event import clean_mask, cmap
+from event_record import EventRecord, calibrated_events
+from dedup import scad_render_dedup
+from geometry_cache import write_if_changed
+from scene_arrays import scad_vector
+from utilities import ref_arrow_3d
+
+
+def load_event_with_waveforms(filename, allowed_tels=None, max_events=50):
+    """
+    Find the biggest event (as load_calibrate) keeping the waveforms only of the best event so far,
+    so that the memory does not grow with the number of events.
+    :param filename: simtel file (or synthetic source, see open_source)
+    :param allowed_tels: set of telescope IDs. None for all the telescopes
+    :param max_events: maximum number of events
+    :return: EventRecord with waveforms
+    """
+    best = None
+    best_amplitude = -np.inf
+    for event in calibrated_events(filename, allowed_tels, max_events):
+        record = EventRecord.from_event(event)
+        amplitude = record.amplitude()
+        if amplitude > best_amplitude:
+            best = EventRecord.from_event(event, keep_waveforms=True)
+            best_amplitude = amplitude
+    print("event: {0}".format(best.event_id))
+    return best
+
+
+def frame_charges(waveform, n_frames):
+    """
+    Charge of each pixel in each time slice
+    :param waveform: (n_pixels, n_samples) calibrated waveform
+    :param n_frames: number of time slices (the samples are split as evenly as possible)
+    :return: (n_frames, n_pixels) charges
+    """
+    n_samples = waveform.shape[1]
+    n_frames = min(n_frames, n_samples)
+    starts = np.array([chunk[0] for chunk in np.array_split(np.arange(n_samples), n_frames)])
+    return np.add.reduceat(waveform, starts, axis=1).T
+
+
+def frame_indices(charges, mask):
+    """
+    Colors of the pixels in each frame as indices of the colormap used by draw_camera (see palette).
+    The charges are normalized to the maximum over all the frames, so that the frames can be compared.
+    palette()[frame_indices(charges, mask)] are the colors cmap gives for the normalized charges.
+    :param charges: (n_frames, n_pixels) charges
+    :param mask: boolean mask of the pixels to be shown (e.g. after the cleaning)
+    :return: (n_frames, n_pixels) indices as uint8
+    """
+    charges = np.clip(charges, 0, None) * mask
+    max_col = np.max(charges)
+    if max_col > 0:
+        charges = charges / max_col
+    # same binning as the colormap lookup
+    return np.clip((charges * cmap.N).astype(int), 0, cmap.N - 1).astype(np.uint8)
+
+
+def palette():
+    """
+    :return: (cmap.N, 4) colors of the colormap as uint8
+    """
+    return (255 * cmap(np.arange(cmap.N))).astype(np.uint8)
+
+
+def palette_lines(n_pixels):
+    """
+    OpenSCAD definitions of the static scene: the colormap, and the colors pix_col_<tel_id> of each camera
+    looked up from the indices pix_idx_<tel_id>. The default indices (all pixels with the color of zero)
+    are overridden by the frame files, which set them after the include of the static scene.
+    :param n_pixels: {tel_id: number of pixels} of all the cameras drawn with color variables
+    """
+    lines = ["pix_palette = {0};".format(scad_vector(palette() / 255., '%.3g'))]
+    for tel_id, n in n_pixels.items():
+        lines.append("pix_idx_{0} = [for (i = [0 : {1}]) 0];".format(tel_id, n - 1))
+        lines.append("{0} = [for (i = pix_idx_{1}) pix_palette[i]];".format(colour_variable(tel_id), tel_id))
+    return lines
+
+
+def write_animation(event, prefix, n_frames=40, tail_cut_bool=True):
+    """
+    Write the animation of an event:
+        - <prefix>_static.scad: telescopes, cameras, MC core and reference frame, plus the colormap. The pixel
+          colors of each camera (pix_col_<tel_id>) are looked up in the colormap from the indices pix_idx_<tel_id>
+        - <prefix>_frame_NNN.scad: include of the static scene + only the pix_idx_<tel_id> indices of the frame
+          (the cameras without waveforms keep the default indices of the static scene)
+        - <prefix>_frames.npz: colormap ('palette', uint8 (256, 4)) and indices of all the frames,
+          uint8 (n_frames, n_pixels) for each telescope
+    Only the colors change between the frames: the geometry and the colormap are written once, and each frame
+    costs one small integer for each pixel.
+    :param event: EventRecord with waveforms
+    :param prefix: prefix of the output files
+    :param n_frames: number of frames
+    :param tail_cut_bool: (bool) show only the pixels surviving the cleaning of the integrated image
+    :return: list of the frame files
+    """
+    # colors of each frame, for the telescopes drawn in the static part
+    indices = {}
+    for tel_id in event.images:
+        camera = event.subarray.tel[tel_id].camera
+        if tel_id not in event.waveforms or camera.cam_id not in ['LSTCam', 'NectarCam', 'FlashCam']:
+            continue
+        if tail_cut_bool:
+            mask = clean_mask(camera, event.images[tel_id])
+        else:
+            mask = np.full(event.images[tel_id].size, True)
+        indices[tel_id] = frame_indices(frame_charges(event.waveforms[tel_id], n_frames), mask)
+
+    np.savez_compressed(prefix + '_frames.npz', palette=palette(),
+                        **{'tel_{0}'.format(tel_id): idx for tel_id, idx in indices.items()})
+
+    # static part
+    static = union()
+    static.add(telescope_camera_event(event=event, colour_vars=True))
+    static = static + mc_details(event=event)
+    static = static + ref_arrow_3d(2000, origin=(1000, 1000, 0),
+                                   label={'x': "x_gnd = NORTH", 'y': "y_gnd = WEST", 'z': "z_gnd"})
+    static_file = prefix + '_static.scad'
+    n_pixels = {tel_id: image.size for tel_id, image in event.images.items()}
+    write_if_changed("\n".join(palette_lines(n_pixels)) + "\n" + scad_render_dedup(static), static_file)
+
+    n_frames = min(idx.shape[0] for idx in indices.values()) if indices else 0
+    frame_files = []
+    for frame in range(n_frames):
+        # after the include: the last assignment of a variable is the one OpenSCAD uses
+        lines = ["include <{0}>".format(os.path.basename(static_file))]
+        lines.extend("pix_idx_{0} = [{1}];".format(tel_id, ','.join(map(str, idx[frame].tolist())))
+                     for tel_id, idx in indices.items())
+        frame_file = '{0}_frame_{1:03d}.scad'.format(prefix, frame)
+        write_if_changed("\n".join(lines) + "\n", frame_file)
+        frame_files.append(frame_file)
+
+    print("written {0} frames + {1}".format(len(frame_files), static_file))
+    return frame_files
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time-resolved animation of the camera images of an event")
+    parser.add_argument('filename', help="simtel file (or synthetic:...,n_samples=40)")
+    parser.add_argument('--frames', type=int, default=40, help="number of frames")
+    parser.add_argument('--prefix', default='animation', help="prefix of the output files")
+    parser.add_argument('--no-cleaning', action='store_true', help="show all the pixels, not only the cleaned image")
+    args = parser.parse_args()
+
+    event = load_event_with_waveforms(args.filename)
+    write_animation(event, args.prefix, n_frames=args.frames, tail_cut_bool=not args.no_cleaning)
@@ -0,0 +1,188 @@
+import numpy as np
+from solid.utils import translate, rotate, union, color, linear_extrude, text, cube, cylinder
+
+from camera_event import draw_camera
+from hillas import ground_lines
+from event_record import load_records, site_from_filename, SITE_LAYOUTS
+from telescope_selection import select_telescopes
+from profiling import stage, get_profiler
+
+from telescope_structure import telescope
+
+
+def load_calibrate(filename, all_tels=False):
+    # LOAD AND CALIBRATE
+    # all_tels=True reads the full array instead of the hard-coded layout: use the selection
+    # options of telescope_camera_event to render only part of it
+
+    # pwd = "/home/thomas/Programs/astro/CTAPIPE_DAN/"
+    # filename = 'gamma_20deg_0deg_run100___cta-prod3-lapalma3-2147m-LaPalma_cone10.simtel.gz'
+    # filename = 'gamma_20deg_0deg_run100___cta-prod3_desert-2150m-Paranal-merged.simtel.gz'
+    # filename = 'gamma_20deg_0deg_run118___cta-prod3_desert-2150m-Paranal-merged_cone10.simtel.gz'
+    # filename = 'gamma_20deg_180deg_run11___cta-prod3_desert-2150m-Paranal-merged_cone10.simtel.gz'
+
+    # layout = np.loadtxt(pwd+'CTA.prod3Sb.3HB9-FG.lis', usecols=0, dtype=int)
+    site = site_from_filename(filename)
+    layout = SITE_LAYOUTS.get(site)
+    if layout is not None:
+        print("{0} WITH {1}".format(site.upper(), layout))
+    else:
+        # no site in the name (e.g. synthetic source): read all the telescopes
+        print("NO SITE FOUND: ALL TELESCOPES")
+
+    print("Layout telescopes IDs:".format(layout))
+
+    # layout = [279, 280, 281, 282, 283, 284, 286, 287, 289, 297, 298, 299,
+    #           300, 301, 302, 303, 304, 305, 306, 307, 308, 315, 316, 317,
+    #           318, 319, 320, 321, 322, 323, 324, 325, 326, 327, 328, 329,
+    #           330, 331, 332, 333, 334, 335, 336, 337, 338, 345, 346, 347,
+    #           348, 349, 350, 375, 376, 377, 378, 379, 380, 393, 400, 402,
+    #           403, 404, 405, 406, 408, 410, 411, 412, 413, 414, 415, 416,
+    #           417]
+
+    layout = None if all_tels or layout is None else set(layout)
+
+    # keep only the compact records (images), not the full ctapipe events
+    events = load_records(filename, allowed_tels=layout, max_events=50)
+
+    # Find "big" event (piece of code from T.V. notebook ...thanks :D )
+    with stage('event selection'):
+        events_amplitude = np.array([event.amplitude() for event in events])
+        mm = events_amplitude.argmax()
+    print("event: {0}".format(mm))
+    event = events[mm]
+
+    return event
+
+
+def colour_variable(tel_id):
+    """
+    :param tel_id: telescope ID
+    :return: name of the OpenSCAD variable with the pixel colors of the telescope
+    """
+    return 'pix_col_{0}'.format(tel_id)
+
+
+def telescope_camera_event(event, radius=None, nearest=None, bbox=None, colour_vars=False, hillas=None, masks=None):
+    """
+    Plot telescope + camera + event on it (if needed). Loop over all the telescopes with data in an event.
+    The function create:
+        - camera display with event visualization and arrows
+        - telescope frame
+        - position every telescope on its right position on ground
+    The telescopes can be selected around the MC core before building any geometry (see select_telescopes).
+
+    :param event: EventRecord selected from simtel file
+    :param radius: render only telescopes within radius (m) from the MC core
+    :param nearest: render only the N telescopes closest to the MC core
+    :param bbox: render only telescopes inside (x_min, x_max, y_min, y_max), in m
+    :param colour_vars: (bool) take the pixel colors of each camera from the OpenSCAD variable pix_col_<tel_id>
+    :param hillas: Hillas parameters of the images (see batched_hillas), to draw the ellipses on the cameras
+    :param masks: cleaning masks of the images (see batched_clean), re-used instead of cleaning each image again
+    :return: return the array to be rendered
+    """
+    itel = select_telescopes(event, radius=radius, nearest=nearest, bbox=bbox)
+    print("id_telescopes:", itel)
+    if not itel:
+        print("no telescope with data passes the selection")
+        return union()
+    subinfo = event.subarray
+    sub_arr_trig = event.subarray.select_subarray('sub_trig', itel).to_table()
+
+    x_tel_trig = sub_arr_trig['tel_pos_x'].to('cm').value
+    y_tel_trig = sub_arr_trig['tel_pos_y'].to('cm').value
+    z_tel_trig = sub_arr_trig['tel_pos_z'].to('cm').value
+
+    label_tel = sub_arr_trig['tel_id']
+    tel_names = sub_arr_trig['tel_description']
+
+    point_dir = {'alt': event.run_array_direction[1].to('deg'),
+                 'az': event.run_array_direction[0].to('deg')}
+
+    # create union object for the array
+    array = union()
+
+    sub_arr_trig.add_index('tel_id')
+    hillas_by_tel = {} if hillas is None else {row['tel_id']: row for row in hillas}
+
+    for tel_id in itel:
+        index = sub_arr_trig.loc_indices[tel_id]
+        if subinfo.tel[tel_id].camera.cam_id in ['CHEC']:
+            continue
+        print('-------------------------')
+        print("tel_id processed: ", tel_id)
+
+        # get telescope name
+        tel_name = tel_names[index]
+
+        # add camera (tail_cut_bool=True means that the plotted image is cleaned)
+        with stage('camera build', tel_id=int(tel_id)):
+            camera_display = draw_camera(event=event, itel=tel_id,
+                                         subarray=subinfo, scale_cam=1.6,
+                                         tail_cut_bool=True,
+                                         colour_var=colour_variable(tel_id) if colour_vars else None,
+                                         hillas=hillas_by_tel.get(tel_id),
+                                         mask=None if masks is None else masks.get(tel_id))
+        get_profiler().count_nodes('camera', camera_display[0], tel_id=int(tel_id))
+
+        origin = (x_tel_trig[index], y_tel_trig[index], z_tel_trig[index])
+        with stage('structure build', tel_id=int(tel_id)):
+            tel_struct = telescope(tel_description=tel_name,
+                                   camera_display_bool=camera_display,
+                                   pointing=point_dir,
+                                   origin=origin,
+                                   tel_num=label_tel[index],
+                                   ref_camera=True,
+                                   ref_tel=False,
+                                   sim_to_real=True)
+        get_profiler().count_nodes('telescope', tel_struct, tel_id=int(tel_id))
+        array.add(tel_struct)
+
+    #array.add(grid_plane())
+
+    return array
+
+
+def mc_details(event):
+    """
+    append MC details to array. Now only:
+        - MC impact point on ground
+    :param event:
+    :return:
+    """
+    # add MC core x and y as a cross
+    cross = text(text="+", size=5000)
+    cross = cross + translate([1000, 1000, 0])(text(text="MC", size=1000))
+    cross = color([1, 0, 0])(linear_extrude(200)(cross))
+    cross = translate([event.core_x.to('cm').value, event.core_y.to('cm').value, 0])(cross)
+    return cross
+
+
+def reco_details(event, hillas, axis):
+    """
+    append the reconstruction to array, to be compared with mc_details:
+        - image axis of each telescope on ground: the lines intersected by reconstruct_axis, projected on the ground
+        - reconstructed core as a cross and shower axis
+    :param event: EventRecord
+    :param hillas: Hillas parameters of the images (see batched_hillas)
+    :param axis: ShowerAxis (see reconstruct_axis), None if the reconstruction failed
+    :return:
+    """
+    details = union()
+    _, points, directions = ground_lines(event, hillas)
+    for point, direction in zip(100 * points, directions):
+        line = cube([60000, 100, 100], center=True)
+        angle = np.rad2deg(np.arctan2(direction[1], direction[0]))
+        details.add(translate([point[0], point[1], 0])(rotate([0, 0, angle])(line)))
+    details = color([0, 0.6, 1, 0.6])(details)
+
+    if axis is not None:
+        core = text(text="+", size=5000)
+        core = core + translate([1000, -2000, 0])(text(text="RECO", size=1000))
+        core = color([0, 0, 1])(linear_extrude(200)(core))
+        # shower axis: cylinder along the reconstructed direction, from the core
+        theta = np.rad2deg(np.arccos(axis.direction[2]))
+        phi = np.rad2deg(np.arctan2(axis.direction[1], axis.direction[0]))
+        shower = color([0, 0, 1])(rotate([0, theta, phi])(cylinder(r=150, h=100000)))
+        details = details + translate([axis.core_x.to('cm').value, axis.core_y.to('cm').value, 0])(core + shower)
+    return details
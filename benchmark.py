@@ -0,0 +1,193 @@
+import sys
+import os
+import json
+import time
+import argparse
+import tracemalloc
+import astropy.units as u
+from solid import scad_render
+from solid.utils import union, cube
+import numpy as np
+
+from camera_event import draw_camera
+from telescope_structure import telescope
+from utilities import arco, rot_arrow, grid_plane
+from ground_utils import tilted_grid, ground_grid
+from hillas import batched_hillas, reconstruct_axis
+from array_scene import reco_details
+from profiling import count_nodes
+from geometry_cache import configure as configure_cache
+from synthetic import CAMERAS, synthetic_layout, synthetic_record
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# a benchmark fails if it is slower (build or SCAD serialisation) than the baseline by more than this fraction
+TIME_TOLERANCE = 0.5
+# ...or if its peak memory is larger by more than this fraction
+MEMORY_TOLERANCE = 0.2
+# ...or if it produces more nodes or bytes than this fraction
+SIZE_TOLERANCE = 0.01
+
+LAYOUT_SIZES = [4, 25, 100, 500]
+
+
+def measure(func, repeat=3):
+    """
+    Run func several times and keep the best wall-clock time, the same for the SCAD serialisation of its result,
+    then build once more under tracemalloc for the peak memory (tracemalloc slows the run down, so it is off
+    while timing)
+    :param func: function with no arguments returning a SolidPython object
+    :param repeat: number of timed runs
+    :return: dictionary with wall_s (build), render_s (scad_render), peak_bytes, nodes, bytes
+    """
+    best = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        obj = func()
+        best = min(best, time.perf_counter() - start)
+
+    best_render = np.inf
+    for i in range(repeat):
+        start = time.perf_counter()
+        scad_text = scad_render(obj)
+        best_render = min(best_render, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'wall_s': best, 'render_s': best_render, 'peak_bytes': peak, 'nodes': count_nodes(obj),
+            'bytes': len(scad_text.encode())}
+
+
+def camera_placeholder():
+    # stand-in for draw_camera output, so that the layout benchmarks measure only the structures
+    return [cube([100, 100, 100], center=True), False]
+
+
+def build_layout(subarray, pointing):
+    array = union()
+    table = subarray.to_table()
+    x_tel = table['tel_pos_x'].to('cm').value
+    y_tel = table['tel_pos_y'].to('cm').value
+    z_tel = table['tel_pos_z'].to('cm').value
+    for index in range(len(table)):
+        array.add(telescope(tel_description=table['tel_description'][index],
+                            camera_display_bool=camera_placeholder(),
+                            pointing=pointing,
+                            origin=(x_tel[index], y_tel[index], z_tel[index]),
+                            tel_num=table['tel_id'][index],
+                            ref_camera=True,
+                            ref_tel=False,
+                            sim_to_real=True))
+    return array
+
+
+def hillas_overlays(event):
+    params = batched_hillas(event)
+    return reco_details(event, params, reconstruct_axis(event, params))
+
+
+def benchmarks(layout_sizes):
+    """
+    :param layout_sizes: number of telescopes of the synthetic layouts
+    :return: dictionary {name: function} of the benchmarks
+    """
+    cases = {}
+    pointing = {'alt': 70 * u.deg, 'az': 0 * u.deg}
+
+    # one telescope for each camera type
+    subarray = synthetic_layout(6)
+    event = synthetic_record(subarray, seed=1)
+    for cam_id in CAMERAS:
+        tel_id = [tel for tel in subarray.tel if subarray.tel[tel].camera.cam_id == cam_id][0]
+        cases['draw_camera_' + cam_id] = (lambda tel_id=tel_id: draw_camera(event=event, itel=tel_id, subarray=subarray,
+                                                                          scale_cam=1.6, tail_cut_bool=True)[0])
+        description = str(subarray.tel[tel_id])
+        cases['telescope_' + description] = (lambda description=description, tel_id=tel_id: telescope(
+            tel_description=description, camera_display_bool=camera_placeholder(), pointing=pointing,
+            origin=(0, 0, 0), tel_num=tel_id, ref_camera=True, ref_tel=False, sim_to_real=True))
+
+    x_arco = np.linspace(-2200/2, 2200/2, 50)
+    cases['arco'] = lambda: arco(x_arco, 4/2300*x_arco**2, 30)
+    cases['rot_arrow'] = lambda: rot_arrow(8000, 0, 70, label='ZEN')
+    cases['grid_plane'] = lambda: grid_plane(grid_unit=20000, count=20, line_weight=200, plane='xy')
+
+    for n_tels in layout_sizes:
+        layout = synthetic_layout(n_tels)
+        layout_event = synthetic_record(layout, seed=2, tel_ids=[])
+        cases['tilted_grid_{0}'.format(n_tels)] = lambda ev=layout_event: tilted_grid(ev, tel_pos=False, zen_az_arrows=True)
+        cases['ground_grid_{0}'.format(n_tels)] = lambda ev=layout_event: ground_grid(ev, tel_pos=False)
+        cases['layout_{0}'.format(n_tels)] = lambda layout=layout: build_layout(layout, pointing)
+        # every telescope triggered: cleaning, Hillas parameters, reconstruction and overlays
+        hillas_event = synthetic_record(layout, seed=3)
+        cases['hillas_{0}'.format(n_tels)] = lambda ev=hillas_event: hillas_overlays(ev)
+
+    return cases
+
+
+def compare(results, baseline):
+    """
+    :return: list of strings describing the regressions with respect to the baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ref = baseline[name]
+        for key in ['wall_s', 'render_s']:
+            if key in ref and result[key] > ref[key] * (1 + TIME_TOLERANCE):
+                regressions.append("{0}: {1} {2:.4f}s > baseline {3:.4f}s".format(name, key, result[key], ref[key]))
+        if result['peak_bytes'] > ref['peak_bytes'] * (1 + MEMORY_TOLERANCE):
+            regressions.append("{0}: peak_bytes {1} > baseline {2}".format(name, result['peak_bytes'],
+                                                                          ref['peak_bytes']))
+        for key in ['nodes', 'bytes']:
+            if result[key] > ref[key] * (1 + SIZE_TOLERANCE):
+                regressions.append("{0}: {1} {2} > baseline {3}".format(name, key, result[key], ref[key]))
+    return regressions
+
+
+def main(args):
+    # the fragment cache would turn every repeat after the first one (and every case re-using a builder
+    # called by an earlier case) into a lookup: the benchmarks measure the geometry building
+    configure_cache(enabled=False)
+    layout_sizes = [n for n in LAYOUT_SIZES if n <= args.max_tels]
+    cases = benchmarks(layout_sizes)
+
+    results = {}
+    for name, func in cases.items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(func, repeat=args.repeat)
+        print("{0:30s} {1:9.4f} s build {2:9.4f} s render {3:12d} B peak {4:8d} nodes {5:11d} B scad".format(
+            name, results[name]['wall_s'], results[name]['render_s'], results[name]['peak_bytes'],
+            results[name]['nodes'], results[name]['bytes']))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("baseline saved to {0}".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        # the baseline depends on the machine: it is not committed, it must be saved once on each machine
+        print("no baseline found ({0}): run with --save-baseline first".format(args.baseline))
+        return 2
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the CREED geometry builders on synthetic cameras and layouts")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each benchmark (best time is kept)")
+    parser.add_argument('--max-tels', type=int, default=max(LAYOUT_SIZES), help="largest synthetic layout")
+    parser.add_argument('--only', default=None, help="run only the benchmarks whose name contains this string")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline file")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    sys.exit(main(parser.parse_args()))
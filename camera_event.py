@@ -1,10 +1,11 @@
 from solid.utils import translate, union
-from solid.utils import color, polygon, circle, cylinder
+from solid.utils import color, polygon, circle, cylinder, square, scale, rotate, difference, linear_extrude
 from ctapipe.image import tailcuts_clean
 import numpy as np
 from solid.utils import multmatrix
 
 from utilities import ref_arrow_2d, rotation
+from scene_arrays import PrismBatch
 
 import matplotlib.pyplot as plt
 
@@ -50,44 +51,65 @@ def circle_trans(center, radius, height):
     return translate([center_x, center_y])(cylinder(r=radius, h=height,  segments=6))
 
 
-def draw_camera(event, itel, subarray, scale_cam=1.0, tail_cut_bool=False):
+def camera_height(camera):
     """
-    Draw camera, either with or without an event. Take info from a simtel file.
-    Make camera a list with the second element a boolean which knows if the camera has data after the cleaning.
-    :param event: event selected from simtel file.
-    :param itel: telescope ID from simtel file. Select only LST IDs for the moment
-    :param subarray: subarray info from the simtel file. Needed for the description of the instrument
-    :param scale_cam: scale the whole camera to see it better
-    :param tail_cut_bool: (bool) decide whether to perform the tailcut
-    :return: return camera object to plot on a telescope object
+    Height of the camera body for the displayed cameras
+    :param camera: camera geometry
+    :return: height in cm
     """
-    camera_display = union()
-
-    camera = subarray.tel[itel].camera
     if camera.cam_id == 'LSTCam':
         cam_height = 200
     elif camera.cam_id == 'NectarCam' or camera.cam_id == 'FlashCam':
         cam_height = 120
-    print('plotting camera: ', camera.cam_id)
+    return cam_height
 
-    x_pix_pos = 100 * camera.pix_x.value
-    y_pix_pos = 100 * camera.pix_y.value
 
-    # calculate pixel size and expand it a bit (1.1 scale)
-    side = 1.1*np.sqrt(((x_pix_pos[0] - x_pix_pos[1]) ** 2 + (y_pix_pos[0] - y_pix_pos[1]) ** 2)) / 2
+def clean_mask(camera, image_cal):
+    """
+    Tailcut cleaning with the thresholds of the camera type (see tail_cut)
+    :param camera: camera geometry
+    :param image_cal: calibrated image
+    :return: boolean mask of the pixels surviving the cleaning
+    """
+    pic_th = tail_cut[camera.cam_id][0]
+    bound_th = tail_cut[camera.cam_id][1]
+    return tailcuts_clean(camera, image_cal,
+                          picture_thresh=pic_th,
+                          boundary_thresh=bound_th,
+                          min_number_picture_neighbors=1)
+
+
+def pixel_colours(image_cal, mask_tail, max_col):
+    """
+    Colour of each pixel from the colormap, with the image normalized to max_col.
+    Pixels outside the mask get the color of zero.
+    :param image_cal: image (or any per-pixel quantity) to be plotted
+    :param mask_tail: boolean mask of the pixels to be plotted
+    :param max_col: value corresponding to the top of the colormap
+    :return: (n_pixels, 4) array of RGBA colors
+    """
+    # for the color plotting of the untriggered telescope
+    try:
+        image_cal = image_cal/max_col
+    except RuntimeWarning:
+        pass
+    return cmap(image_cal * mask_tail)
+
 
+def image_colours(camera, image_cal, tail_cut_bool=False, mask=None):
+    """
+    Pixel colors of an image, as drawn on the camera (see draw_camera)
+    :param camera: camera geometry
+    :param image_cal: calibrated image
+    :param tail_cut_bool: (bool) decide whether to perform the tailcut
+    :param mask: cleaning mask already computed (e.g. by batched_clean), used with tail_cut_bool instead of the tailcut
+    :return: (n_pixels, 4) array of RGBA colors, and the boolean for an empty image after the cleaning
+    """
     data_after_cleaning = False
 
     # Perform tailcut cleaning on image
-    pic_th = tail_cut[camera.cam_id][0]
-    bound_th = tail_cut[camera.cam_id][1]
-    image_cal = event.dl1.tel[itel].image[0]
-
     if tail_cut_bool:
-        mask_tail = tailcuts_clean(camera, image_cal,
-                                   picture_thresh=pic_th,
-                                   boundary_thresh=bound_th,
-                                   min_number_picture_neighbors=1)
+        mask_tail = clean_mask(camera, image_cal) if mask is None else mask
 
         max_col = np.max(image_cal*mask_tail)
 
@@ -95,24 +117,95 @@ def draw_camera(event, itel, subarray, scale_cam=1.0, tail_cut_bool=False):
         data_after_cleaning = np.sum(mask_tail) == 0
 
     else:
-        mask_tail = np.full(x_pix_pos.size, True)
+        mask_tail = np.full(image_cal.size, True)
         max_col = np.max(image_cal)
 
-    # for the color plotting of the untriggered telescope
-    try:
-        image_cal = image_cal/max_col
-    except RuntimeWarning:
-        pass
+    return pixel_colours(image_cal, mask_tail, max_col), data_after_cleaning
+
+
+def hillas_ellipse(hillas, cam_height, scale_cam=1.0, line_weight=4):
+    """
+    Hillas ellipse (semi-axes length and width) and major axis of the image, in the camera frame.
+    The overlay is a bit higher than the pixels, so that it can be seen on both sides of the camera.
+    :param hillas: Hillas parameters of the image (row of batched_hillas)
+    :param cam_height: height of the camera
+    :param scale_cam: same scale as the camera
+    :param line_weight: thickness of the lines (cm)
+    :return: overlay
+    """
+    length = 100 * hillas['length'] * scale_cam
+    width = 100 * hillas['width'] * scale_cam
+    ring = difference()(scale([length + line_weight, width + line_weight])(circle(r=1, segments=48)),
+                        scale([max(length - line_weight, 0.1), max(width - line_weight, 0.1)])(circle(r=1, segments=48)))
+    ellipse = ring + square([4 * length, line_weight], center=True)
+    ellipse = linear_extrude(height=cam_height + 20)(ellipse)
+    ellipse = rotate([0, 0, np.rad2deg(hillas['psi'])])(ellipse)
+    ellipse = translate([100 * hillas['x'] * scale_cam, 100 * hillas['y'] * scale_cam, -10])(ellipse)
+    return color([1, 0, 0])(ellipse)
+
+
+def camera_pixels(camera, colours, scale_cam=1.0):
+    """
+    Pixels of a camera as prisms (before the transformations of camera_image)
+    :param camera: camera geometry
+    :param colours: (n_pixels, 4) array of RGBA colors (or name of an OpenSCAD variable with them)
+    :param scale_cam: scale the whole camera to see it better
+    :return: PrismBatch
+    """
+    x_pix_pos = 100 * camera.pix_x.value
+    y_pix_pos = 100 * camera.pix_y.value
+
+    # calculate pixel size and expand it a bit (1.1 scale)
+    side = 1.1*np.sqrt(((x_pix_pos[0] - x_pix_pos[1]) ** 2 + (y_pix_pos[0] - y_pix_pos[1]) ** 2)) / 2
+
+    # all the pixels in one array-backed node: one prism for each pixel, same as circle_trans
+    centers = np.stack((x_pix_pos * scale_cam, y_pix_pos * scale_cam), axis=1)
+    return PrismBatch(centers, radius=side * scale_cam, height=camera_height(camera), colours=colours)
+
 
-    for i in range(x_pix_pos.size):
-        # camera_display.add((hexagon((x_pix_pos[i],y_pix_pos[i]), side, 6)))
-        colore = list(cmap(image_cal[i] * mask_tail[i]))
-        center = (x_pix_pos[i] * scale_cam, y_pix_pos[i] * scale_cam)
-        camera_display.add(color(colore)(circle_trans(center=center, radius=side * scale_cam, height=cam_height)))
+def camera_image(camera, colours, scale_cam=1.0, hillas=None):
+    """
+    Draw the pixels of a camera with the given colors, plus the reference arrows of the camera frame.
+    :param camera: camera geometry
+    :param colours: (n_pixels, 4) array of RGBA colors, see pixel_colours (or name of an OpenSCAD variable with them)
+    :param scale_cam: scale the whole camera to see it better
+    :param hillas: Hillas parameters of the image, to draw the ellipse (see hillas_ellipse). None for no ellipse
+    :return: camera display
+    """
+    camera_display = union()
+    cam_height = camera_height(camera)
+    camera_display.add(camera_pixels(camera, colours, scale_cam=scale_cam))
+    if hillas is not None and np.isfinite(hillas['psi']):
+        camera_display.add(hillas_ellipse(hillas, cam_height, scale_cam=scale_cam))
 
     camera_display = camera_display.add(translate([0, 0, cam_height/2])(ref_arrow_2d(400, label={'x': "x_sim", 'y': "y_sim"}, origin=(0, 0))))
     camera_display = multmatrix(m=rotation(180, 'y'))(camera_display)
     camera_display = translate([0, 0, cam_height/2])(camera_display)
+    return camera_display
+
+
+def draw_camera(event, itel, subarray, scale_cam=1.0, tail_cut_bool=False, colour_var=None, hillas=None, mask=None):
+    """
+    Draw camera, either with or without an event. Take info from a simtel file.
+    Make camera a list with the second element a boolean which knows if the camera has data after the cleaning.
+    :param event: EventRecord selected from simtel file.
+    :param itel: telescope ID from simtel file. Select only LST IDs for the moment
+    :param subarray: subarray info from the simtel file. Needed for the description of the instrument
+    :param scale_cam: scale the whole camera to see it better
+    :param tail_cut_bool: (bool) decide whether to perform the tailcut
+    :param colour_var: name of an OpenSCAD variable with the pixel colors, defined outside of the scene
+                       (e.g. by the frames of an animation). None to use the colors of the image
+    :param hillas: Hillas parameters of the image (row of batched_hillas) to draw the ellipse. None for no ellipse
+    :param mask: cleaning mask of the image (see batched_clean). None to clean the image here
+    :return: return camera object to plot on a telescope object
+    """
+    camera = subarray.tel[itel].camera
+    print('plotting camera: ', camera.cam_id)
+
+    colours, data_after_cleaning = image_colours(camera, event.images[itel], tail_cut_bool=tail_cut_bool, mask=mask)
+    if colour_var is not None:
+        colours = colour_var
+    camera_display = camera_image(camera, colours, scale_cam=scale_cam, hillas=hillas)
 
     # return also the boolean for the cleaned image
     camera_display_arr = [camera_display, data_after_cleaning]
@@ -0,0 +1,230 @@
+import os
+import glob
+import json
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from event_record import EventRecord, calibrated_events, site_from_filename, site_from_header
+
+# one row per event. 'first' and 'n_tels' point to the triggered telescopes in tel_ids.npy,
+# 'file_index' to the list of files in meta.json
+CATALOGUE_DTYPE = np.dtype([('file_index', np.int32), ('event_id', np.int64), ('site', 'U8'),
+                            ('az', np.float64), ('alt', np.float64),
+                            ('n_tels', np.int32), ('n_lst', np.int32), ('n_mst', np.int32), ('n_sst', np.int32),
+                            ('amplitude', np.float64), ('core_x', np.float64), ('core_y', np.float64),
+                            ('first', np.int64)])
+
+# telescope types counted in n_lst, n_mst, n_sst (optics.tel_type: the subtypes, e.g. SST-ASTRI or MST-SCT,
+# are counted with their type)
+TEL_TYPES = ['LST', 'MST', 'SST']
+
+
+def scan_file(filename, max_events=None):
+    """
+    Read and calibrate all the events of a simtel file and keep one catalogue row for each of them.
+    Run in the worker processes of build_catalogue.
+    :param filename: simtel file
+    :param max_events: maximum number of events. None for all the events
+    :return: array of CATALOGUE_DTYPE (file_index and first not set), list of the arrays of triggered telescopes
+    """
+    site = None
+    rows = []
+    tel_ids = []
+    tel_types = {}
+    for event in calibrated_events(filename, max_events=max_events):
+        if site is None:
+            # run metadata, the file name only for the files without it
+            site = site_from_header(event.mcheader) or site_from_filename(os.path.basename(filename))
+        record = EventRecord.from_event(event)
+        ids = np.array(sorted(record.images), dtype=np.int32)
+        for tel_id in ids:
+            if tel_id not in tel_types:
+                tel_types[tel_id] = record.subarray.tel[tel_id].optics.tel_type
+        types = [tel_types[tel_id] for tel_id in ids]
+        counts = [types.count(tel_type) for tel_type in TEL_TYPES]
+        direction = record.run_array_direction
+        rows.append((0, record.event_id, site,
+                     direction[0].to('deg').value, direction[1].to('deg').value,
+                     ids.size, counts[0], counts[1], counts[2],
+                     record.amplitude(), record.core_x.to('m').value, record.core_y.to('m').value, 0))
+        tel_ids.append(ids)
+    return np.array(rows, dtype=CATALOGUE_DTYPE), tel_ids
+
+
+class Catalogue(object):
+    """
+    Event catalogue of a production, written by build_catalogue:
+        - events.npy: one row per event (CATALOGUE_DTYPE)
+        - tel_ids.npy: triggered telescopes of all the events, one after the other
+        - meta.json: scanned files (name, size, modification time, number of events)
+    """
+
+    def __init__(self, cat_dir, load=True):
+        """
+        :param cat_dir: catalogue directory
+        :param load: read the catalogue of cat_dir if it exists. False for an empty catalogue
+        """
+        self.cat_dir = cat_dir
+        if load and os.path.exists(os.path.join(cat_dir, 'meta.json')):
+            self.events = np.load(os.path.join(cat_dir, 'events.npy'))
+            self.all_tel_ids = np.load(os.path.join(cat_dir, 'tel_ids.npy'))
+            with open(os.path.join(cat_dir, 'meta.json')) as f:
+                self.files = json.load(f)['files']
+        else:
+            self.events = np.zeros(0, dtype=CATALOGUE_DTYPE)
+            self.all_tel_ids = np.zeros(0, dtype=np.int32)
+            self.files = []
+
+    def __len__(self):
+        return len(self.events)
+
+    def tel_ids(self, i):
+        """
+        :param i: row of the event
+        :return: IDs of the triggered telescopes
+        """
+        row = self.events[i]
+        return self.all_tel_ids[row['first']:row['first'] + row['n_tels']]
+
+    def filename(self, i):
+        """
+        :param i: row of the event
+        :return: simtel file of the event
+        """
+        return self.files[self.events[i]['file_index']]['name']
+
+    def select(self, site=None, n_lst=None, min_lst=None, min_tels=None):
+        """
+        :param site: 'Paranal', 'LaPalma' or 'nosite'. None for all the sites
+        :param n_lst: exact number of triggered LSTs
+        :param min_lst: minimum number of triggered LSTs
+        :param min_tels: minimum number of triggered telescopes
+        :return: rows of the selected events
+        """
+        mask = np.ones(len(self.events), dtype=bool)
+        if site is not None:
+            mask &= self.events['site'] == site
+        if n_lst is not None:
+            mask &= self.events['n_lst'] == n_lst
+        if min_lst is not None:
+            mask &= self.events['n_lst'] >= min_lst
+        if min_tels is not None:
+            mask &= self.events['n_tels'] >= min_tels
+        return np.flatnonzero(mask)
+
+    def biggest(self, n=20, **cuts):
+        """
+        The n events with the largest amplitude among the selected ones, e.g. biggest(20, n_lst=4)
+        :param n: number of events
+        :param cuts: selection, see select
+        :return: rows of the events, from the biggest one
+        """
+        rows = self.select(**cuts)
+        return rows[np.argsort(-self.events['amplitude'][rows], kind='stable')][:n]
+
+    def write(self, cat_dir=None):
+        cat_dir = self.cat_dir if cat_dir is None else cat_dir
+        if not os.path.isdir(cat_dir):
+            os.makedirs(cat_dir)
+        np.save(os.path.join(cat_dir, 'events.npy'), self.events)
+        np.save(os.path.join(cat_dir, 'tel_ids.npy'), self.all_tel_ids)
+        with open(os.path.join(cat_dir, 'meta.json'), 'w') as f:
+            json.dump({'files': self.files}, f, indent=2)
+
+
+def _file_info(filename):
+    stat = os.stat(filename)
+    return {'name': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def build_catalogue(directory, cat_dir, pattern='*.simtel*', jobs=None, max_events=None):
+    """
+    Scan the simtel files of a directory in parallel worker processes and write the catalogue.
+    If the catalogue already exists, only the new or modified files are scanned; the events of
+    the files that are not in the directory any more are dropped.
+    :param directory: directory of the simtel files
+    :param cat_dir: catalogue directory
+    :param pattern: pattern of the simtel file names
+    :param jobs: number of worker processes. None for the number of cores
+    :param max_events: maximum number of events of each file. None for all the events
+    :return: Catalogue
+    """
+    old = Catalogue(cat_dir)
+    infos = [_file_info(filename) for filename in sorted(glob.glob(os.path.join(directory, pattern)))]
+    known = {(info['name'], info['size'], info['mtime']): index for index, info in enumerate(old.files)}
+
+    # keep the events of the unchanged files
+    files = []
+    events = []
+    tel_ids = []
+    to_scan = []
+    for info in infos:
+        index = known.get((info['name'], info['size'], info['mtime']))
+        if index is None:
+            to_scan.append(info)
+            continue
+        rows = np.flatnonzero(old.events['file_index'] == index)
+        kept = old.events[rows].copy()
+        kept['file_index'] = len(files)
+        events.append(kept)
+        tel_ids.extend(old.tel_ids(i) for i in rows)
+        files.append(dict(old.files[index]))
+    print("{0} files in the catalogue, {1} to scan".format(len(files), len(to_scan)))
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(scan_file, info['name'], max_events): info for info in to_scan}
+        for future in as_completed(futures):
+            info = futures[future]
+            try:
+                rows, file_tel_ids = future.result()
+            except Exception as err:
+                # not added to the files: it is scanned again by the next update
+                print("FAILED {0}: {1}".format(info['name'], err))
+                continue
+            rows['file_index'] = len(files)
+            events.append(rows)
+            tel_ids.extend(file_tel_ids)
+            files.append(dict(info, n_events=len(rows)))
+            print("{0}: {1} events".format(info['name'], len(rows)))
+
+    catalogue = Catalogue(cat_dir, load=False)
+    catalogue.files = files
+    catalogue.events = np.concatenate(events) if events else np.zeros(0, dtype=CATALOGUE_DTYPE)
+    n_tels = np.array([ids.size for ids in tel_ids], dtype=np.int64)
+    catalogue.events['first'] = np.cumsum(n_tels) - n_tels
+    catalogue.all_tel_ids = np.concatenate(tel_ids).astype(np.int32) if tel_ids else np.zeros(0, dtype=np.int32)
+    catalogue.write()
+    return catalogue
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Event catalogue of a directory of simtel files")
+    subparsers = parser.add_subparsers(dest='command')
+    build = subparsers.add_parser('build', help="scan the new files of the directory and update the catalogue")
+    build.add_argument('directory', help="directory of the simtel files")
+    build.add_argument('cat_dir', help="catalogue directory")
+    build.add_argument('--pattern', default='*.simtel*', help="pattern of the simtel file names")
+    build.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: cores)")
+    build.add_argument('--max-events', type=int, default=None, help="maximum number of events of each file")
+    top = subparsers.add_parser('top', help="list the biggest events")
+    top.add_argument('cat_dir', help="catalogue directory")
+    top.add_argument('-n', type=int, default=20, help="number of events")
+    top.add_argument('--site', default=None, help="Paranal, LaPalma")
+    top.add_argument('--n-lst', type=int, default=None, help="exact number of triggered LSTs")
+    top.add_argument('--min-tels', type=int, default=None, help="minimum number of triggered telescopes")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        catalogue = build_catalogue(args.directory, args.cat_dir, pattern=args.pattern, jobs=args.jobs,
+                                    max_events=args.max_events)
+        print("{0} events from {1} files".format(len(catalogue), len(catalogue.files)))
+    elif args.command == 'top':
+        catalogue = Catalogue(args.cat_dir)
+        for i in catalogue.biggest(args.n, site=args.site, n_lst=args.n_lst, min_tels=args.min_tels):
+            event = catalogue.events[i]
+            print("{0} event {1}: amplitude {2:.0f}, {3} tels ({4} LST), core ({5:.1f}, {6:.1f}) m".format(
+                catalogue.filename(i), event['event_id'], event['amplitude'], event['n_tels'], event['n_lst'],
+                event['core_x'], event['core_y']))
+    else:
+        parser.print_help()
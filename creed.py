@@ -0,0 +1,187 @@
+import argparse
+import cProfile
+from solid import scad_render
+from solid.utils import union
+
+from array_scene import load_calibrate, telescope_camera_event, mc_details, reco_details
+from ground_utils import tilted_grid, ground_grid
+from hillas import batched_clean, batched_hillas, reconstruct_axis
+from preview import write_preview
+from event_record import site_from_filename
+from profiling import stage, get_profiler, enable as enable_profiler
+from geometry_cache import write_if_changed, configure as configure_cache
+from dedup import scad_render_dedup
+from utilities import ref_arrow_3d
+from telescope_selection import n_telescopes
+
+# sub-scenes that can be built from the same event
+SCENES = ['array', 'ground', 'tilted', 'mc']
+
+
+def check_scenes(scenes):
+    unknown = set(scenes) - set(SCENES)
+    if unknown:
+        raise ValueError("unknown scenes {0}: use {1}".format(sorted(unknown), SCENES))
+
+
+def reconstruction(event):
+    """
+    Hillas parameters of all the telescopes with data (not only the rendered ones) and stereo reconstruction
+    :return: Hillas parameters, ShowerAxis (None if the reconstruction failed), cleaning masks (re-used by the cameras)
+    """
+    with stage('hillas'):
+        masks = batched_clean(event)
+        params = batched_hillas(event, masks=masks)
+        axis = reconstruct_axis(event, params)
+    return params, axis, masks
+
+
+def build_scenes(event, scenes, radius=None, nearest=None, bbox=None, hillas=False, tel_pos=False):
+    """
+    Build the requested sub-scenes of an event in one tree:
+        - array: telescopes + cameras with the event (see telescope_camera_event) and ground reference arrows
+        - ground: grid and reference frame of the GroundFrame
+        - tilted: grid and reference frame of the TiltedGroundFrame, with the AZ and ZEN arrows
+        - mc: MC core (and the reconstruction with hillas=True)
+    The static parts (arrows, grids, structures) come from the fragment cache and are written once by dedup.
+    :param event: EventRecord
+    :param scenes: list of sub-scenes, see SCENES
+    :param radius: see telescope_camera_event
+    :param nearest: see telescope_camera_event
+    :param bbox: see telescope_camera_event
+    :param hillas: (bool) draw the Hillas ellipses and the stereo reconstruction
+    :param tel_pos: (bool) plot the telescopes as spheres on the ground and tilted grids
+    :return: union of the sub-scenes
+    """
+    check_scenes(scenes)
+    scene = union()
+    params, axis, masks = reconstruction(event) if hillas else (None, None, None)
+
+    if 'array' in scenes:
+        scene.add(telescope_camera_event(event=event, radius=radius, nearest=nearest, bbox=bbox, hillas=params,
+                                         masks=masks))
+        # dimension, origin and label of reference arrow
+        scene.add(ref_arrow_3d(2000,
+                               origin=(1000, 1000, 0),
+                               label={'x': "x_gnd = NORTH", 'y': "y_gnd = WEST", 'z': "z_gnd"}))
+    if 'ground' in scenes:
+        with stage('ground build'):
+            scene.add(ground_grid(event=event, tel_pos=tel_pos))
+    if 'tilted' in scenes:
+        with stage('tilted build'):
+            scene.add(tilted_grid(event=event, tel_pos=tel_pos, zen_az_arrows=True))
+    if 'mc' in scenes:
+        scene.add(mc_details(event=event))
+        if hillas:
+            scene.add(reco_details(event, params, axis))
+    return scene
+
+
+def write_scene(scene, file_out, dedup=True):
+    """
+    Render the tree in one pass and write it (only if the content has changed)
+    :param scene: root of the tree
+    :param file_out: output file
+    :param dedup: (bool) write repeated subtrees once as OpenSCAD modules (see scad_render_dedup)
+    """
+    get_profiler().count_nodes('scene', scene)
+    with stage('tree render'):
+        if dedup:
+            scad_text = scad_render_dedup(scene)
+        else:
+            scad_text = scad_render(scene)
+    with stage('file write'):
+        written = write_if_changed(scad_text, file_out)
+    if written:
+        get_profiler().add_bytes(file_out, len(scad_text.encode()))
+
+
+def main(filename, scenes=SCENES, file_out=None, all_tels=False, radius=None, nearest=None, bbox=None, dedup=True,
+         hillas=False, tel_pos=False, preview=None):
+    """
+    Load and calibrate the simtel file once, then build all the requested sub-scenes of the selected event
+    and write them in one output file.
+    With preview (PNG file name) only a quick-look image of the event is written, no OpenSCAD file.
+    :param filename: simtel file (or synthetic source)
+    :param scenes: list of sub-scenes, see build_scenes
+    :param file_out: output file. None for creed_<site>.scad
+    """
+    check_scenes(scenes)
+    event = load_calibrate(filename, all_tels=all_tels)
+    if preview:
+        params, axis, masks = reconstruction(event) if hillas else (None, None, None)
+        with stage('preview'):
+            write_preview(event, preview, hillas=params, axis=axis, masks=masks)
+        return
+
+    scene = build_scenes(event, scenes, radius=radius, nearest=nearest, bbox=bbox, hillas=hillas, tel_pos=tel_pos)
+    if file_out is None:
+        file_out = 'creed_' + site_from_filename(filename) + '.scad'
+    write_scene(scene, file_out, dedup=dedup)
+
+
+def add_arguments(parser):
+    """
+    Options shared by the CREED programs (see 3Dmodels.py)
+    :param parser: argparse parser
+    """
+    parser.add_argument('filename', help="simtel file")
+    parser.add_argument('--all-tels', action='store_true',
+                        help="read all the telescopes, not only the default layout of the site")
+    parser.add_argument('--radius', type=float, default=None,
+                        help="render only telescopes within RADIUS meters from the MC core")
+    parser.add_argument('--nearest', type=n_telescopes, default=None,
+                        help="render only the NEAREST telescopes closest to the MC core")
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('X_MIN', 'X_MAX', 'Y_MIN', 'Y_MAX'),
+                        help="render only telescopes inside the box (meters)")
+    parser.add_argument('--profile', default=None, metavar='REPORT_JSON',
+                        help="write time, node counts and bytes of each stage to a JSON report")
+    parser.add_argument('--profile-memory', action='store_true',
+                        help="with --profile, also measure the peak memory of each stage with tracemalloc "
+                             "(slower: the times are inflated)")
+    parser.add_argument('--cprofile', default=None, metavar='STATS_FILE',
+                        help="also run the whole program under cProfile and dump the stats")
+    parser.add_argument('--no-dedup', action='store_true',
+                        help="write every subtree in place instead of defining repeated subtrees as modules")
+    parser.add_argument('--cache-dir', default=None,
+                        help="keep the serialised static geometry (structures, arrows, grids) in this directory between runs")
+    parser.add_argument('--hillas', action='store_true',
+                        help="draw the Hillas ellipses and the stereo reconstruction of core and shower axis")
+    parser.add_argument('--preview', default=None, metavar='OUT_PNG',
+                        help="write only a quick-look PNG of the event (ground view and camera images), no OpenSCAD file")
+
+
+def run(args, scenes, file_out=None, tel_pos=False):
+    """
+    Run main with the options of add_arguments, with profiling and cache settings
+    """
+    if args.cache_dir:
+        configure_cache(cache_dir=args.cache_dir)
+    if args.profile:
+        profiler = enable_profiler(memory=args.profile_memory)
+    if args.cprofile:
+        cprof = cProfile.Profile()
+        cprof.enable()
+
+    main(args.filename, scenes=scenes, file_out=file_out, all_tels=args.all_tels, radius=args.radius,
+         nearest=args.nearest, bbox=args.bbox, dedup=not args.no_dedup, hillas=args.hillas, tel_pos=tel_pos,
+         preview=args.preview)
+
+    if args.cprofile:
+        cprof.disable()
+        cprof.dump_stats(args.cprofile)
+    if args.profile:
+        profiler.stop()
+        profiler.write(args.profile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render the array, ground and tilted views of an event from one load")
+    add_arguments(parser)
+    parser.add_argument('--scenes', default=','.join(SCENES),
+                        help="comma-separated sub-scenes: {0}".format(','.join(SCENES)))
+    parser.add_argument('--out', default=None, help="output file (default: creed_<site>.scad)")
+    parser.add_argument('--tel-pos', action='store_true', help="plot the telescopes as spheres on the grids")
+    args = parser.parse_args()
+    run(args, scenes=[scene.strip() for scene in args.scenes.split(',') if scene.strip()], file_out=args.out,
+        tel_pos=args.tel_pos)
@@ -0,0 +1,121 @@
+import hashlib
+
+# rendered length of a module call "\nm_<12 hex>();"
+CALL_LENGTH = 18
+
+
+def _indent(s):
+    return s.replace("\n", "\n\t")
+
+
+def _is_fragment(node):
+    # nodes with their own serialisation (e.g. ScadFragment): rendered as they are
+    return hasattr(node, 'scad_text')
+
+
+def _header(node):
+    if node.name in ['hole', 'part']:
+        return ''
+    return node._render_str_no_children()
+
+
+class _Node(object):
+    """
+    Hash and size of a subtree, computed once for each SolidPython object
+    """
+    __slots__ = ('digest', 'size', 'obj', 'children')
+
+    def __init__(self, digest, size, obj, children):
+        self.digest = digest
+        self.size = size
+        self.obj = obj
+        self.children = children
+
+
+def _hash_tree(obj, counts, seen):
+    """
+    Structural hash of the subtree (header of each node + hashes of the children, in order).
+    :param obj: SolidPython object
+    :param counts: {digest: number of occurrences in the tree}, updated
+    :param seen: {id(obj): _Node} for the objects added in several places of the tree
+    :return: _Node
+    """
+    key = id(obj)
+    if key in seen:
+        node = seen[key]
+        _count(node, counts)
+        return node
+
+    if _is_fragment(obj):
+        text = obj.scad_text
+        node = _Node(hashlib.sha1(text.encode()).hexdigest(), len(text), obj, [])
+    else:
+        header = _header(obj)
+        children = [_hash_tree(child, counts, seen) for child in obj.children]
+        digest = hashlib.sha1()
+        digest.update(header.encode())
+        for child in children:
+            digest.update(child.digest.encode())
+        size = len(header) + sum(child.size for child in children) + 4
+        node = _Node(digest.hexdigest(), size, obj, children)
+
+    seen[key] = node
+    counts[node.digest] = counts.get(node.digest, 0) + 1
+    return node
+
+
+def _count(node, counts):
+    # an object re-used in another place of the tree: its whole subtree appears once more
+    counts[node.digest] = counts.get(node.digest, 0) + 1
+    for child in node.children:
+        _count(child, counts)
+
+
+def _render(node, modules, definition=False):
+    if node.digest in modules and not definition:
+        return "\nm_" + node.digest[:12] + "();"
+    if _is_fragment(node.obj):
+        return node.obj.scad_text
+    header = _header(node.obj)
+    body = "".join(_render(child, modules) for child in node.children)
+    if not header:
+        return body
+    if not node.children:
+        return header + ";"
+    return header + " {" + _indent(body) + "\n}"
+
+
+def scad_render_dedup(root):
+    """
+    Render a SolidPython tree to OpenSCAD, writing each repeated subtree only once as a module
+    (hash-consing): e.g. the arrows of every camera reference frame, the spiders of the MSTs,
+    the pixel prisms (equal apart from their translation). A subtree becomes a module when
+    this makes the output shorter. The rendered geometry is the same as with scad_render.
+    Holes and parts (SolidPython extensions) are not supported.
+    :param root: root of the tree
+    :return: OpenSCAD code
+    """
+    counts = {}
+    seen = {}
+    tree = _hash_tree(root, counts, seen)
+
+    # keep the nodes by digest, to write the module definitions
+    by_digest = {}
+    for node in seen.values():
+        by_digest.setdefault(node.digest, node)
+
+    modules = set()
+    for digest, count in counts.items():
+        node = by_digest[digest]
+        if node is tree:
+            continue
+        saving = count * (node.size - CALL_LENGTH) - (node.size + CALL_LENGTH)
+        if count > 1 and saving > 0:
+            modules.add(digest)
+
+    definitions = []
+    for digest in sorted(modules):
+        body = _render(by_digest[digest], modules, definition=True)
+        definitions.append("\nmodule m_" + digest[:12] + "() {" + _indent(body) + "\n}")
+
+    return "".join(definitions) + "\n" + _render(tree, modules) + "\n"
@@ -0,0 +1,167 @@
+import numpy as np
+
+from ctapipe.io import event_source
+from ctapipe.calib import CameraCalibrator
+
+from profiling import stage, skip
+
+
+class EventRecord(object):
+    """
+    Compact copy of the few fields of a ctapipe event that CREED really uses for the rendering.
+    Only the integrated calibrated images are kept (one NumPy array per telescope), the waveforms
+    and the rest of the DataContainer are dropped, so one record is a few kB instead of MBs.
+
+    Fields:
+        - event_id: event ID from the simtel file
+        - tels_with_data: list of telescope IDs with data (same as event.r0.tels_with_data)
+        - images: dictionary {tel_id: calibrated image (np.array, float32)}
+        - subarray: subarray description (shared between all the records of a file, NOT copied)
+        - run_array_direction: (az, alt) of the array pointing, as in event.mcheader.run_array_direction
+        - core_x, core_y: MC impact point on ground (astropy quantities)
+        - waveforms: dictionary {tel_id: calibrated waveform (n_pixels, n_samples)}, only if requested
+    """
+    __slots__ = ('event_id', 'tels_with_data', 'images', 'subarray',
+                 'run_array_direction', 'core_x', 'core_y', 'waveforms')
+
+    def __init__(self, event_id, tels_with_data, images, subarray, run_array_direction, core_x, core_y,
+                 waveforms=None):
+        self.event_id = event_id
+        self.tels_with_data = tels_with_data
+        self.images = images
+        self.subarray = subarray
+        self.run_array_direction = run_array_direction
+        self.core_x = core_x
+        self.core_y = core_y
+        self.waveforms = waveforms
+
+    @classmethod
+    def from_event(cls, event, keep_waveforms=False):
+        """
+        Create the record from a calibrated ctapipe event.
+        The images are copied: the event source re-uses the same container for the next event.
+        :param event: calibrated event from the event_source
+        :param keep_waveforms: (bool) also copy the calibrated waveforms (dl0), e.g. for the animations
+        :return: EventRecord
+        """
+        tels_with_data = list(event.r0.tels_with_data)
+        images = {}
+        for tel_id in tels_with_data:
+            image = event.dl1.tel[tel_id].image
+            if image is not None:
+                images[tel_id] = np.array(image[0], dtype=np.float32)
+
+        waveforms = None
+        if keep_waveforms:
+            waveforms = {tel_id: np.array(event.dl0.tel[tel_id].waveform[0], dtype=np.float32)
+                         for tel_id in images}
+
+        return cls(event_id=event.r0.event_id,
+                   tels_with_data=tels_with_data,
+                   images=images,
+                   subarray=event.inst.subarray,
+                   run_array_direction=event.mcheader.run_array_direction.copy(),
+                   core_x=event.mc.core_x.copy(),
+                   core_y=event.mc.core_y.copy(),
+                   waveforms=waveforms)
+
+    def amplitude(self):
+        """
+        Total amplitude of the event: sum of the calibrated images of all the telescopes
+        :return: (float) amplitude
+        """
+        return float(sum(image.sum() for image in self.images.values()))
+
+    def nbytes(self):
+        """
+        Memory used by the images of the record
+        :return: (int) bytes
+        """
+        n_bytes = sum(image.nbytes for image in self.images.values())
+        if self.waveforms is not None:
+            n_bytes += sum(waveform.nbytes for waveform in self.waveforms.values())
+        return n_bytes
+
+
+# default telescope layout of each site (the 4 LSTs)
+SITE_LAYOUTS = {'Paranal': [4, 5, 6, 11],
+                'LaPalma': [5, 6, 7, 8]}
+
+
+def site_from_filename(filename):
+    """
+    Guess the site from the name of the simtel file (e.g. ..._desert-2150m-Paranal-merged.simtel.gz)
+    :param filename: simtel file
+    :return: 'Paranal', 'LaPalma' or 'nosite'
+    """
+    if "Paranal" in filename:
+        return "Paranal"
+    elif "palma" in filename:
+        return "LaPalma"
+    return "nosite"
+
+
+def site_from_header(mcheader):
+    """
+    Site of the run from the geomagnetic field of the MC run header: the CTA productions simulate
+    La Palma in the northern hemisphere (field pointing down, positive inclination) and Paranal in the southern one.
+    :param mcheader: event.mcheader
+    :return: 'Paranal', 'LaPalma' or None if the header has no geomagnetic field (e.g. synthetic events)
+    """
+    inclination = getattr(mcheader, 'prod_site_B_inclination', None)
+    if inclination is None or not np.isfinite(inclination.to('rad').value):
+        return None
+    return "LaPalma" if inclination.to('rad').value > 0 else "Paranal"
+
+
+def open_source(filename):
+    """
+    Open the event source: the simtel file with ctapipe, or a SyntheticEventSource if the name
+    starts with 'synthetic:' (e.g. 'synthetic:n_tels=200,n_events=1000,seed=1', see SyntheticEventSource)
+    :param filename: simtel file or synthetic source description
+    :return: event source
+    """
+    if filename.startswith('synthetic:'):
+        from synthetic import SyntheticEventSource
+        return SyntheticEventSource.from_url(filename)
+    return event_source(filename)
+
+
+def calibrated_events(filename, allowed_tels=None, max_events=None):
+    """
+    Generator over the calibrated events of a simtel file.
+    The same ctapipe container is yielded (and overwritten) at each step: copy what is needed.
+    :param filename: simtel file (or synthetic source, see open_source)
+    :param allowed_tels: set of telescope IDs to be read. None for all the telescopes
+    :param max_events: maximum number of events to be read. None for all the events
+    :return: calibrated event
+    """
+    with stage('source open'):
+        source = open_source(filename)
+    if max_events is not None:
+        source.max_events = max_events
+    if allowed_tels is not None:
+        source.allowed_tels = set(allowed_tels)
+
+    if getattr(source, 'is_calibrated', False):
+        for event in source:
+            skip('calibration', 'source already calibrated', event_id=event.r0.event_id)
+            yield event
+        return
+
+    cal = CameraCalibrator(None, None, r1_product='HESSIOR1Calibrator', extractor_product='NeighbourPeakIntegrator')
+    for event in source:
+        with stage('calibration', event_id=event.r0.event_id):
+            cal.calibrate(event)
+        yield event
+
+
+def load_records(filename, allowed_tels=None, max_events=None):
+    """
+    Read and calibrate the events of a simtel file and keep only the compact records
+    :param filename: simtel file
+    :param allowed_tels: set of telescope IDs to be read. None for all the telescopes
+    :param max_events: maximum number of events to be read. None for all the events
+    :return: list of EventRecord
+    """
+    return [EventRecord.from_event(event) for event in calibrated_events(filename, allowed_tels, max_events)]
@@ -0,0 +1,202 @@
+import os
+import sys
+import hashlib
+import inspect
+import functools
+from collections import OrderedDict
+import numpy as np
+from solid import scad_render
+from solid.solidpython import OpenSCADObject
+
+
+class ScadFragment(OpenSCADObject):
+    """
+    Subtree which is already serialised to OpenSCAD: it is rendered as the stored text.
+    It can be used as any other object (transformations, union, add to a parent).
+    """
+
+    def __init__(self, scad_text):
+        OpenSCADObject.__init__(self, name='fragment', params={})
+        self.scad_text = scad_text
+
+    def _render(self, render_holes=False):
+        return self.scad_text
+
+
+class FragmentCache(object):
+    """
+    Serialised fragments keyed by the hash of the builder call: in memory with LRU eviction,
+    optionally also on disk (one <key>.scad file for each fragment) to be re-used by the next runs.
+    """
+
+    def __init__(self, max_entries=512, cache_dir=None, enabled=True):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.scad')
+
+    def get(self, key):
+        """
+        :param key: hash of the builder call
+        :return: serialised fragment, or None if it is not in the cache
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            with open(self._path(key)) as f:
+                scad_text = f.read()
+            self._store(key, scad_text)
+            self.hits += 1
+            return scad_text
+        self.misses += 1
+        return None
+
+    def put(self, key, scad_text):
+        self._store(key, scad_text)
+        if self.cache_dir is not None:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(self._path(key), 'w') as f:
+                f.write(scad_text)
+
+    def _store(self, key, scad_text):
+        self._memory[key] = scad_text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        self._memory.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# cache shared by all the builders decorated with cached_fragment
+cache = FragmentCache()
+
+# part of every key: increase it to invalidate all the fragments stored on disk (e.g. for a new SolidPython)
+CACHE_VERSION = 1
+
+# directory of the CREED modules, see module_hash
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def configure(max_entries=None, cache_dir=None, enabled=None):
+    """
+    Change the settings of the shared cache
+    :param max_entries: number of fragments kept in memory
+    :param cache_dir: directory of the on-disk store (None: memory only)
+    :param enabled: (bool) switch the memoisation on/off
+    """
+    if max_entries is not None:
+        cache.max_entries = max_entries
+    if cache_dir is not None:
+        cache.cache_dir = cache_dir
+    if enabled is not None:
+        cache.enabled = enabled
+
+
+def _key_part(value):
+    """
+    Hashable description of an argument. Arrays are hashed by content (repr truncates big arrays).
+    """
+    if hasattr(value, 'unit') and hasattr(value, 'value'):
+        return ('quantity', str(value.unit), _key_part(value.value))
+    if isinstance(value, np.ndarray):
+        return ('array', value.dtype.str, value.shape, hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest())
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return ('dict', tuple(sorted((repr(k), _key_part(v)) for k, v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_key_part(v) for v in value))
+    return repr(value)
+
+
+@functools.lru_cache(maxsize=None)
+def module_hash(module_name):
+    """
+    Hash of the full source of a module and of the CREED modules it imports from: a change in a builder,
+    in the helpers it calls (e.g. utilities.arrow) or in the constants it reads gives new keys.
+    It does not depend on the import order, so all the programs share the fragments on disk.
+    :param module_name: module of a builder
+    :return: sha1 hex digest
+    """
+    names = {module_name}
+    for value in vars(sys.modules[module_name]).values():
+        name = value.__name__ if inspect.ismodule(value) else getattr(value, '__module__', None)
+        path = getattr(sys.modules.get(name), '__file__', None) if isinstance(name, str) else None
+        if path is not None and os.path.dirname(os.path.abspath(path)) == _PACKAGE_DIR:
+            names.add(name)
+    digest = hashlib.sha1(str(CACHE_VERSION).encode())
+    for name in sorted(names):
+        with open(sys.modules[name].__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def call_key(func_id, args, kwargs):
+    """
+    :param func_id: identifier of the builder (name + hash of its module, see module_hash)
+    :return: hash of the builder call
+    """
+    description = repr((func_id, _key_part(args), _key_part(kwargs)))
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def cached_fragment(func):
+    """
+    Decorator for the geometry builders: the result is serialised once for each set of arguments and
+    re-used as a ScadFragment. The source of the builder module (and of the modules it imports from,
+    see module_hash) is part of the key, so a change in the code invalidates the fragments stored on disk.
+    """
+    name = func.__module__ + '.' + func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not cache.enabled:
+            return func(*args, **kwargs)
+        # hashed at the first call, when the module is completely imported
+        key = call_key(name + ':' + module_hash(func.__module__), args, kwargs)
+        scad_text = cache.get(key)
+        if scad_text is None:
+            scad_text = func(*args, **kwargs)._render()
+            cache.put(key, scad_text)
+        return ScadFragment(scad_text)
+
+    return wrapper
+
+
+def write_if_changed(scad_text, filename):
+    """
+    Write the text only if it is different from the content of the file on disk (same sha256)
+    :param scad_text: rendered OpenSCAD code
+    :param filename: output file
+    :return: True if the file has been written
+    """
+    new_hash = hashlib.sha256(scad_text.encode()).hexdigest()
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            if hashlib.sha256(f.read()).hexdigest() == new_hash:
+                print("{0} unchanged, not written".format(filename))
+                return False
+    with open(filename, 'w') as f:
+        f.write(scad_text)
+    return True
+
+
+def write_scad(obj, filename):
+    """
+    Render the tree and write it only if the output has changed
+    :param obj: root of the tree
+    :param filename: output file
+    :return: True if the file has been written
+    """
+    return write_if_changed(scad_render(obj), filename)
@@ -1,11 +1,24 @@
-from solid.utils import translate, rotate, union
-from solid.utils import cylinder, color, sphere
+from solid.utils import rotate, union
+from solid.utils import cylinder, color
 import numpy as np
 from ctapipe.coordinates import HorizonFrame, TiltedGroundFrame, GroundFrame, NominalFrame, CameraFrame, TelescopeFrame
 
 import astropy.units as u
 
-from utilities import ref_arrow_3d, grid_plane, ref_arrow_2d, rot_arrow
+from utilities import ref_arrow_3d, grid_plane, ref_arrow_2d, rot_arrow, rotation
+from scene_arrays import MarkerBatch
+
+def tilted_rotation(alt, az):
+    """
+    Rotation from the tilted frame to the ground frame, same as rotate([0, 90 - alt, az]) used to draw
+    the tilted system (see tilted_grid)
+    :param alt: pointing altitude (Quantity)
+    :param az: pointing azimuth (Quantity)
+    :return: 3x3 rotation matrix
+    """
+    rot = np.dot(rotation(az.to('deg').value, 'z'), rotation(90 - alt.to('deg').value, 'y'))
+    return np.array(rot)[:3, :3]
+
 
 def tilted_grid(event, tel_pos=False, zen_az_arrows=False):
     """
@@ -15,16 +28,16 @@ def tilted_grid(event, tel_pos=False, zen_az_arrows=False):
     :param zen_az_arrows: plot curved arrows for ZEN and AZ in titled ref frame
     :return:
     """
-    alt = event.mcheader.run_array_direction[1]
-    az = event.mcheader.run_array_direction[0]
+    alt = event.run_array_direction[1]
+    az = event.run_array_direction[0]
 
     array_pointing = HorizonFrame(alt=alt, az=az)
-    ground_coordinates = GroundFrame(x=event.inst.subarray.tel_coords.x,
-                                     y=event.inst.subarray.tel_coords.y,
-                                     z=event.inst.subarray.tel_coords.z,  # *0+15.0*u.m,
+    ground_coordinates = GroundFrame(x=event.subarray.tel_coords.x,
+                                     y=event.subarray.tel_coords.y,
+                                     z=event.subarray.tel_coords.z,  # *0+15.0*u.m,
                                      pointing_direction=array_pointing)
 
-    tilted = ground_coordinates.transform_to("TiltedGroundFrame")
+    tilted = ground_coordinates.transform_to(TiltedGroundFrame(pointing_direction=array_pointing))
 
     grid_unit = 20000  # in centimeters
     tilted_system = union()
@@ -32,11 +45,8 @@ def tilted_grid(event, tel_pos=False, zen_az_arrows=False):
 
     # ADD TELESCOPES AS SPHERES
     if tel_pos:
-        # for i in range(tilted.x.size):
-        for i in range(50):
-            coords = [100*tilted.x[i].value, 100*tilted.y[i].value]
-            position = translate(coords)(color([1, 0, 0])(sphere(r=800)))
-            tilted_system.add(position)
+        coords = np.stack((100*tilted.x.value, 100*tilted.y.value), axis=1)
+        tilted_system.add(MarkerBatch(coords, radius=800, colour=[1, 0, 0]))
 
     # add GRID
     grid_tilted = grid_plane(grid_unit=grid_unit,
@@ -50,11 +60,14 @@ def tilted_grid(event, tel_pos=False, zen_az_arrows=False):
     tilted_system = rotate([0, 90-alt.to('deg').value, az.to('deg').value])(tilted_system)
     tilted_system.add(grid_tilted)
 
-    arr_curved_az = color([1, 1, 0])(rot_arrow(8000, az.to('deg').value, 0, label='AZ'))
-    tilted_system.add(arr_curved_az)
-    arr_curved_alt = color([1, 0, 1])(rot_arrow(8000, 0, 90-alt.to('deg').value, label='ZEN'))
-    arr_curved_alt = rotate([90, 0, 0])(arr_curved_alt)
-    tilted_system.add(arr_curved_alt)
+    # no arrow for a zero angle (e.g. az = 0): rot_arrow needs angle_init != angle_end
+    if az.to('deg').value != 0:
+        arr_curved_az = color([1, 1, 0])(rot_arrow(8000, az.to('deg').value, 0, label='AZ'))
+        tilted_system.add(arr_curved_az)
+    if alt.to('deg').value != 90:
+        arr_curved_alt = color([1, 0, 1])(rot_arrow(8000, 0, 90-alt.to('deg').value, label='ZEN'))
+        arr_curved_alt = rotate([90, 0, 0])(arr_curved_alt)
+        tilted_system.add(arr_curved_alt)
 
     return tilted_system
 
@@ -66,24 +79,21 @@ def ground_grid(event, tel_pos=False):
     :param tel_pos: (bool) if True, plot the telescopes as spheres
     :return:
     """
-    alt = event.mcheader.run_array_direction[1]
-    az = event.mcheader.run_array_direction[0]
+    alt = event.run_array_direction[1]
+    az = event.run_array_direction[0]
     array_pointing = HorizonFrame(alt=alt, az=az)
 
-    ground_coordinates = GroundFrame(x=event.inst.subarray.tel_coords.x,
-                                     y=event.inst.subarray.tel_coords.y,
-                                     z=event.inst.subarray.tel_coords.z,
+    ground_coordinates = GroundFrame(x=event.subarray.tel_coords.x,
+                                     y=event.subarray.tel_coords.y,
+                                     z=event.subarray.tel_coords.z,
                                      pointing_direction=array_pointing)
 
     grid_unit = 20000  # in centimeters
 
     ground_system = union()
     if tel_pos:
-        # for i in range(ground_coordinates.x.size):
-        for i in range(50):
-            coords = [100*ground_coordinates.x[i].value, 100*ground_coordinates.y[i].value, 100*ground_coordinates.z[i].value]
-            position = translate(coords)(color([0, 0, 1])(sphere(r=800)))
-            ground_system.add(position)
+        coords = 100*np.stack((ground_coordinates.x.value, ground_coordinates.y.value, ground_coordinates.z.value), axis=1)
+        ground_system.add(MarkerBatch(coords, radius=800, colour=[0, 0, 1]))
 
     grid = grid_plane(grid_unit=grid_unit,
                       count=2 * int(100 * np.max(np.abs(ground_coordinates.x.value)) / grid_unit),
@@ -0,0 +1,320 @@
+import hashlib
+import numpy as np
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from scipy.sparse import csr_matrix
+from ctapipe.coordinates import CameraFrame, HorizonFrame
+from ctapipe.coordinates.ground_frames import get_shower_trans_matrix
+
+from camera_event import tail_cut
+
+# one row for each telescope: image moments in the camera frame (m, rad)
+HILLAS_DTYPE = np.dtype([('tel_id', 'i4'), ('size', 'f8'), ('n_pixels', 'i4'),
+                         ('x', 'f8'), ('y', 'f8'), ('r', 'f8'), ('phi', 'f8'),
+                         ('length', 'f8'), ('width', 'f8'), ('psi', 'f8')])
+
+
+class CameraPixels(object):
+    """
+    Pixel positions (m) and neighbour matrix of a camera geometry, shared by all the telescopes with that camera.
+    Used to clean and parametrise the images of all these telescopes at once.
+    """
+
+    # one entry for each camera geometry: the neighbours are computed only the first time
+    _cameras = {}
+
+    def __init__(self, camera):
+        self.cam_id = camera.cam_id
+        self.x = camera.pix_x.to('m').value
+        self.y = camera.pix_y.to('m').value
+        self.neighbours = csr_matrix(np.asarray(camera.neighbor_matrix), dtype=np.int32)
+
+    @classmethod
+    def for_camera(cls, camera):
+        """
+        :param camera: camera geometry
+        :return: CameraPixels of the camera geometry, built only the first time
+        """
+        key = geometry_key(camera)
+        if key not in cls._cameras:
+            cls._cameras[key] = cls(camera)
+        return cls._cameras[key]
+
+    def _neighbour_count(self, masks):
+        # number of selected neighbours of each pixel, for all the images: (n_pix, n_pix) x (n_pix, n_images)
+        return self.neighbours.dot(masks.T.astype(np.int32)).T
+
+    def clean(self, images):
+        """
+        Tailcut cleaning of a stack of images, with the thresholds of the camera type.
+        Same selection as clean_mask (tailcuts_clean with min_number_picture_neighbors=1) for each image.
+        :param images: (n_images, n_pixels) calibrated images
+        :return: (n_images, n_pixels) boolean masks
+        """
+        picture_thresh, boundary_thresh = tail_cut[self.cam_id]
+        above_picture = images >= picture_thresh
+        in_picture = above_picture & (self._neighbour_count(above_picture) >= 1)
+        above_boundary = images >= boundary_thresh
+        return ((above_boundary & (self._neighbour_count(in_picture) > 0)) |
+                (in_picture & (self._neighbour_count(above_boundary) > 0)))
+
+
+def geometry_key(camera):
+    """
+    :param camera: camera geometry
+    :return: key of the geometry: name and hash of the pixel positions (two versions of a camera can share the name)
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(camera.pix_x.to('m').value).tobytes())
+    digest.update(np.ascontiguousarray(camera.pix_y.to('m').value).tobytes())
+    return camera.cam_id, digest.hexdigest()
+
+
+def _camera_groups(event, tel_ids):
+    # telescopes with the same camera geometry, to be processed as one stack
+    groups = {}
+    for tel_id in tel_ids:
+        camera = event.subarray.tel[tel_id].camera
+        groups.setdefault(geometry_key(camera), (camera, []))[1].append(tel_id)
+    return groups.values()
+
+
+def batched_clean(event, tel_ids=None):
+    """
+    Tailcut cleaning of the images of all the telescopes of an event, one stacked array for each camera geometry.
+    The masks can be given to batched_hillas and draw_camera, so that each image is cleaned only once.
+    :param event: EventRecord
+    :param tel_ids: telescopes to clean. None for all the telescopes with an image
+    :return: dictionary {tel_id: boolean mask}
+    """
+    if tel_ids is None:
+        tel_ids = sorted(event.images)
+    masks = {}
+    for camera, ids in _camera_groups(event, tel_ids):
+        pixels = CameraPixels.for_camera(camera)
+        images = np.stack([event.images[tel_id] for tel_id in ids])
+        masks.update(zip(ids, pixels.clean(images)))
+    return masks
+
+
+def hillas_moments(x, y, images):
+    """
+    Hillas parameters of a stack of (cleaned) images of the same camera type, without a loop over the images.
+    Images with less than 3 pixels get NaN parameters.
+    :param x: pixel x positions (m)
+    :param y: pixel y positions (m)
+    :param images: (n_images, n_pixels) images, zero outside the cleaning mask
+    :return: array of HILLAS_DTYPE (tel_id not set)
+    """
+    params = np.zeros(len(images), dtype=HILLAS_DTYPE)
+    params['size'] = images.sum(axis=1)
+    params['n_pixels'] = np.count_nonzero(images > 0, axis=1)
+    for name in ['x', 'y', 'r', 'phi', 'length', 'width', 'psi']:
+        params[name] = np.nan
+
+    good = (params['n_pixels'] >= 3) & (params['size'] > 0)
+    if not np.any(good):
+        return params
+
+    weights = images[good] / params['size'][good][:, np.newaxis]
+    mean_x = weights.dot(x)
+    mean_y = weights.dot(y)
+    cov = np.empty((len(weights), 2, 2))
+    cov[:, 0, 0] = weights.dot(x * x) - mean_x ** 2
+    cov[:, 1, 1] = weights.dot(y * y) - mean_y ** 2
+    cov[:, 0, 1] = cov[:, 1, 0] = weights.dot(x * y) - mean_x * mean_y
+
+    # eigenvalues in ascending order: minor then major axis
+    eig_vals, eig_vecs = np.linalg.eigh(cov)
+    eig_vals = np.clip(eig_vals, 0, None)
+
+    params['x'][good] = mean_x
+    params['y'][good] = mean_y
+    params['r'][good] = np.hypot(mean_x, mean_y)
+    params['phi'][good] = np.arctan2(mean_y, mean_x)
+    params['length'][good] = np.sqrt(eig_vals[:, 1])
+    params['width'][good] = np.sqrt(eig_vals[:, 0])
+    with np.errstate(divide='ignore'):
+        params['psi'][good] = np.arctan(eig_vecs[:, 1, 1] / eig_vecs[:, 0, 1])
+    return params
+
+
+def batched_hillas(event, tel_ids=None, masks=None):
+    """
+    Clean and parametrise the images of all the telescopes of an event, grouping the telescopes by camera geometry:
+    each group is cleaned and parametrised as one stacked array.
+    :param event: EventRecord
+    :param tel_ids: telescopes to parametrise. None for all the telescopes with an image
+    :param masks: cleaning masks already computed (see batched_clean). None to clean the images here
+    :return: array of HILLAS_DTYPE, one row for each telescope
+    """
+    if tel_ids is None:
+        tel_ids = sorted(event.images)
+
+    params = []
+    for camera, ids in _camera_groups(event, tel_ids):
+        pixels = CameraPixels.for_camera(camera)
+        images = np.stack([event.images[tel_id] for tel_id in ids]).astype(np.float64)
+        if masks is None:
+            images *= pixels.clean(images)
+        else:
+            images *= np.stack([masks[tel_id] for tel_id in ids])
+        cam_params = hillas_moments(pixels.x, pixels.y, images)
+        cam_params['tel_id'] = ids
+        params.append(cam_params)
+    if not params:
+        return np.zeros(0, dtype=HILLAS_DTYPE)
+    return np.concatenate(params)
+
+
+def intersect_lines(points, directions, weights):
+    """
+    Weighted least-squares intersection of 2D lines (point minimising the weighted squared distances)
+    :param points: (n, 2) one point of each line
+    :param directions: (n, 2) unit vectors along the lines
+    :param weights: (n,) weights
+    :return: (x, y), or None if the lines are (nearly) parallel
+    """
+    proj = np.eye(2)[np.newaxis] - directions[:, :, np.newaxis] * directions[:, np.newaxis, :]
+    a = np.einsum('i,ijk->jk', weights, proj)
+    b = np.einsum('i,ijk,ik->j', weights, proj, points)
+    if np.linalg.cond(a) > 1e6:
+        return None
+    return np.linalg.solve(a, b)
+
+
+class ShowerAxis(object):
+    """
+    Stereo reconstruction of the shower axis from the image axes of the telescopes
+    """
+    __slots__ = ('core_x', 'core_y', 'direction', 'offset', 'tel_ids')
+
+    def __init__(self, core_x, core_y, direction, offset, tel_ids):
+        self.core_x = core_x
+        self.core_y = core_y
+        self.direction = direction
+        self.offset = offset
+        self.tel_ids = tel_ids
+
+
+def tilted_matrix(event):
+    """
+    :param event: EventRecord
+    :return: 3x3 rotation from the ground frame to the TiltedGroundFrame of the array pointing (as ctapipe)
+    """
+    az, alt = event.run_array_direction
+    return get_shower_trans_matrix(az.to('rad').value, alt.to('rad').value)
+
+
+def image_axes(event, params):
+    """
+    Centroid and major axis of each image in the tilted frame, through the camera -> sky transformation of ctapipe
+    (CameraFrame with focal length and rotation of the camera, pointing of the array). The sky directions are
+    projected on the plane perpendicular to the pointing, with the axes of the TiltedGroundFrame.
+    :param event: EventRecord
+    :param params: Hillas parameters, see batched_hillas (finite psi)
+    :return: centroids (n, 2) as offsets from the pointing (rad), unit vectors (n, 2) along the image axes
+    """
+    az, alt = event.run_array_direction
+    pointing = SkyCoord(alt=alt, az=az, frame=HorizonFrame())
+    trans = tilted_matrix(event)
+
+    centroids = np.zeros((len(params), 2))
+    axes = np.zeros((len(params), 2))
+    # one transformation for the telescopes with the same optics and camera rotation
+    groups = {}
+    for k, tel_id in enumerate(params['tel_id']):
+        tel = event.subarray.tel[tel_id]
+        key = (tel.optics.equivalent_focal_length.to('m').value, tel.camera.cam_rotation.to('deg').value)
+        groups.setdefault(key, []).append(k)
+    for (focal, cam_rotation), rows in groups.items():
+        frame = CameraFrame(focal_length=focal * u.m, rotation=cam_rotation * u.deg, telescope_pointing=pointing)
+        group = params[rows]
+        # centroid, and a point 1 cm further along the major axis
+        x = np.concatenate((group['x'], group['x'] + 0.01 * np.cos(group['psi'])))
+        y = np.concatenate((group['y'], group['y'] + 0.01 * np.sin(group['psi'])))
+        sky = SkyCoord(x=x * u.m, y=y * u.m, frame=frame).transform_to(HorizonFrame())
+        sky_alt = sky.alt.to('rad').value
+        sky_az = sky.az.to('rad').value
+        # unit vectors in the ground frame (x north, y west), then tilted frame
+        ground = np.stack((np.cos(sky_alt) * np.cos(sky_az), -np.cos(sky_alt) * np.sin(sky_az), np.sin(sky_alt)),
+                          axis=1)
+        tilted = ground.dot(trans.T)
+        offsets = tilted[:, :2] / tilted[:, 2:]
+        centroids[rows] = offsets[:len(rows)]
+        along = offsets[len(rows):] - offsets[:len(rows)]
+        axes[rows] = along / np.linalg.norm(along, axis=1)[:, np.newaxis]
+    return centroids, axes
+
+
+def _good_images(params, min_size):
+    with np.errstate(invalid='ignore'):
+        return np.isfinite(params['psi']) & (params['size'] >= min_size) & (params['length'] > 0)
+
+
+def _to_ground(trans, tilted_xy):
+    """
+    Points of the tilted plane moved along the pointing down to the ground (z = 0), as project_to_ground of ctapipe
+    :param trans: ground -> tilted rotation, see tilted_matrix
+    :param tilted_xy: (n, 2) points in the tilted frame
+    :return: (n, 3) points on the ground
+    """
+    points = tilted_xy.dot(trans[:2])
+    pointing = trans[2]
+    return points - points[:, 2:] / pointing[2] * pointing
+
+
+def reconstruct_axis(event, params, min_size=50.):
+    """
+    Intersect the image axes: the core in the tilted frame (lines through the telescope positions) and the
+    arrival direction in the field of view (lines through the image centroids), see image_axes.
+    :param event: EventRecord
+    :param params: Hillas parameters, see batched_hillas
+    :param min_size: minimum image size (p.e.) to use a telescope
+    :return: ShowerAxis, or None if less than two images can be used
+    """
+    params = params[_good_images(params, min_size)]
+    if len(params) < 2:
+        return None
+
+    trans = tilted_matrix(event)
+    positions = np.array([event.subarray.positions[tel_id].to('m').value for tel_id in params['tel_id']])
+    tilted = positions.dot(trans.T)
+    centroids, axes = image_axes(event, params)
+    weights = params['size'] * (1 - params['width'] / params['length'])
+
+    core_tilted = intersect_lines(tilted[:, :2], axes, weights)
+    offset = intersect_lines(centroids, axes, weights)
+    if core_tilted is None or offset is None:
+        return None
+
+    direction = trans.T.dot(np.array([offset[0], offset[1], 1.]))
+    direction /= np.linalg.norm(direction)
+    # from the tilted plane down to the ground along the pointing, as project_to_ground of ctapipe
+    core = _to_ground(trans, core_tilted[np.newaxis])[0]
+    return ShowerAxis(core_x=core[0] * u.m,
+                      core_y=core[1] * u.m,
+                      direction=direction,
+                      offset=offset * u.rad,
+                      tel_ids=params['tel_id'])
+
+
+def ground_lines(event, params, min_size=50.):
+    """
+    Lines of the core fit of reconstruct_axis (image axes through the telescope positions in the tilted frame),
+    projected along the pointing on the ground, to draw them with the reconstructed core
+    :param event: EventRecord
+    :param params: Hillas parameters, see batched_hillas
+    :param min_size: minimum image size (p.e.), as reconstruct_axis
+    :return: telescope IDs, points (n, 2) and unit directions (n, 2) on the ground (m)
+    """
+    params = params[_good_images(params, min_size)]
+    if len(params) == 0:
+        return params['tel_id'], np.zeros((0, 2)), np.zeros((0, 2))
+    trans = tilted_matrix(event)
+    positions = np.array([event.subarray.positions[tel_id].to('m').value for tel_id in params['tel_id']])
+    tilted = positions.dot(trans.T)[:, :2]
+    _, axes = image_axes(event, params)
+    points = _to_ground(trans, tilted)
+    directions = _to_ground(trans, tilted + axes) - points
+    directions = directions[:, :2] / np.linalg.norm(directions[:, :2], axis=1)[:, np.newaxis]
+    return params['tel_id'], points[:, :2], directions
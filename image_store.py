@@ -0,0 +1,189 @@
+import sys
+import os
+import json
+import numpy as np
+import astropy.units as u
+
+from event_record import EventRecord, calibrated_events
+
+# offset table: one row per (event, telescope) with the row of the image in the array of its camera
+INDEX_DTYPE = np.dtype([('event_index', np.int64), ('tel_id', np.int32), ('cam_index', np.int16), ('row', np.int64)])
+
+# one row per event, 'first' and 'n_tels' point to the rows of the offset table
+EVENTS_DTYPE = np.dtype([('event_id', np.int64), ('az', np.float64), ('alt', np.float64),
+                         ('core_x', np.float64), ('core_y', np.float64),
+                         ('first', np.int64), ('n_tels', np.int32)])
+
+IMAGE_DTYPE = np.float32
+
+
+def export_images(filename, store_dir, allowed_tels=None, max_events=None):
+    """
+    Calibrate all the events of a simtel file and write the images into a memory-mapped store:
+        - <cam_id>.dat: one contiguous (n_events, n_pixels) float32 array for each camera type
+        - index.npy: event/telescope offset table (INDEX_DTYPE)
+        - events.npy: pointing and MC core of each event (EVENTS_DTYPE)
+        - meta.json: shape of the camera arrays
+    Images are appended while the file is read, so the memory does not grow with the number of events.
+    A store already in store_dir is replaced (also the camera files of the cameras not in the new export).
+    :param filename: simtel file
+    :param store_dir: output directory
+    :param allowed_tels: set of telescope IDs to be stored. None for all the telescopes
+    :param max_events: maximum number of events to be stored. None for all the events
+    :return: path of the store
+    """
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    for name in os.listdir(store_dir):
+        if name.endswith('.dat') or name in ('index.npy', 'events.npy', 'meta.json'):
+            os.remove(os.path.join(store_dir, name))
+
+    cam_ids = []
+    cam_files = {}
+    n_rows = {}
+    n_pixels = {}
+    index = []
+    events = []
+
+    try:
+        for event_index, event in enumerate(calibrated_events(filename, allowed_tels, max_events)):
+            first = len(index)
+            subarray = event.inst.subarray
+            for tel_id in event.r0.tels_with_data:
+                image = event.dl1.tel[tel_id].image
+                if image is None:
+                    continue
+                cam_id = subarray.tel[tel_id].camera.cam_id
+                if cam_id not in cam_files:
+                    cam_ids.append(cam_id)
+                    cam_files[cam_id] = open(os.path.join(store_dir, cam_id + '.dat'), 'wb')
+                    n_rows[cam_id] = 0
+                    n_pixels[cam_id] = image[0].size
+                cam_files[cam_id].write(np.ascontiguousarray(image[0], dtype=IMAGE_DTYPE).tobytes())
+                index.append((event_index, tel_id, cam_ids.index(cam_id), n_rows[cam_id]))
+                n_rows[cam_id] += 1
+
+            direction = event.mcheader.run_array_direction
+            events.append((event.r0.event_id,
+                           direction[0].to('deg').value, direction[1].to('deg').value,
+                           event.mc.core_x.to('m').value, event.mc.core_y.to('m').value,
+                           first, len(index) - first))
+    finally:
+        for cam_file in cam_files.values():
+            cam_file.close()
+
+    np.save(os.path.join(store_dir, 'index.npy'), np.array(index, dtype=INDEX_DTYPE))
+    np.save(os.path.join(store_dir, 'events.npy'), np.array(events, dtype=EVENTS_DTYPE))
+
+    meta = {'source': os.path.basename(filename),
+            'dtype': np.dtype(IMAGE_DTYPE).name,
+            'cameras': [{'cam_id': cam_id, 'n_rows': n_rows[cam_id], 'n_pixels': n_pixels[cam_id]}
+                        for cam_id in cam_ids]}
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    print("stored {0} events, {1} images in {2}".format(len(events), len(index), store_dir))
+    return store_dir
+
+
+class ImageStore(object):
+    """
+    Read-only access to a store written by export_images.
+    The camera arrays are memory-mapped: images are views on the files, nothing is decoded or copied.
+
+    example:
+
+    store = ImageStore('run100_images')
+    event = store.record(12, subarray=subarray)
+    camera_display = draw_camera(event=event, itel=5, subarray=subarray)
+    """
+
+    def __init__(self, store_dir, subarray=None):
+        """
+        :param store_dir: directory written by export_images
+        :param subarray: subarray description of the simtel file, attached to the records (optional)
+        """
+        self.store_dir = store_dir
+        self.subarray = subarray
+
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.cam_ids = [camera['cam_id'] for camera in self.meta['cameras']]
+        self.index = np.load(os.path.join(store_dir, 'index.npy'))
+        self.events = np.load(os.path.join(store_dir, 'events.npy'))
+        self._arrays = {}
+
+    def __len__(self):
+        return self.events.size
+
+    def images(self, cam_id):
+        """
+        Memory-mapped (n_images, n_pixels) array with all the images of one camera type
+        :param cam_id: camera name, e.g. 'LSTCam'
+        :return: np.memmap
+        """
+        if cam_id not in self._arrays:
+            camera = self.meta['cameras'][self.cam_ids.index(cam_id)]
+            self._arrays[cam_id] = np.memmap(os.path.join(self.store_dir, cam_id + '.dat'),
+                                             dtype=self.meta['dtype'], mode='r',
+                                             shape=(camera['n_rows'], camera['n_pixels']))
+        return self._arrays[cam_id]
+
+    def _event_rows(self, event_index):
+        first = self.events['first'][event_index]
+        return self.index[first:first + self.events['n_tels'][event_index]]
+
+    def tel_ids(self, event_index):
+        """
+        :param event_index: position of the event in the store
+        :return: list of telescope IDs with an image
+        """
+        return [int(tel_id) for tel_id in self._event_rows(event_index)['tel_id']]
+
+    def image(self, event_index, tel_id):
+        """
+        :param event_index: position of the event in the store
+        :param tel_id: telescope ID
+        :return: image of the telescope (view on the memory-mapped array)
+        """
+        rows = self._event_rows(event_index)
+        sel = rows[rows['tel_id'] == tel_id]
+        if sel.size == 0:
+            raise KeyError("telescope {0} has no image in event {1}".format(tel_id, event_index))
+        return self.images(self.cam_ids[sel['cam_index'][0]])[sel['row'][0]]
+
+    def record(self, event_index, subarray=None):
+        """
+        Create the EventRecord of one event, which can be passed to draw_camera and telescope_camera_event.
+        :param event_index: position of the event in the store
+        :param subarray: subarray description. Default is the one given to the store
+        :return: EventRecord with memory-mapped images
+        """
+        rows = self._event_rows(event_index)
+        images = {}
+        for row in rows:
+            images[int(row['tel_id'])] = self.images(self.cam_ids[row['cam_index']])[row['row']]
+
+        info = self.events[event_index]
+        return EventRecord(event_id=int(info['event_id']),
+                           tels_with_data=list(images.keys()),
+                           images=images,
+                           subarray=subarray if subarray is not None else self.subarray,
+                           run_array_direction=u.Quantity([info['az'], info['alt']], u.deg),
+                           core_x=info['core_x'] * u.m,
+                           core_y=info['core_y'] * u.m)
+
+    def amplitudes(self):
+        """
+        Total amplitude of each event, computed from the stored images
+        :return: np.array with one amplitude per event
+        """
+        amplitude = np.zeros(len(self))
+        for cam_index, cam_id in enumerate(self.cam_ids):
+            rows = self.index[self.index['cam_index'] == cam_index]
+            np.add.at(amplitude, rows['event_index'], self.images(cam_id)[rows['row']].sum(axis=1))
+        return amplitude
+
+
+if __name__ == '__main__':
+    export_images(sys.argv[1], sys.argv[2])
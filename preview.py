@@ -0,0 +1,124 @@
+import os
+import argparse
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.gridspec import GridSpec
+from matplotlib.patches import Ellipse
+
+from camera_event import image_colours
+from ground_utils import tilted_rotation
+from event_record import EventRecord, calibrated_events
+
+# colors of the telescope markers on the ground
+TEL_COLOURS = {'LST': 'tab:orange', 'MST': 'tab:green', 'SST': 'tab:purple'}
+
+
+def ground_view(ax, event, axis=None):
+    """
+    Top-down view of the array: telescopes (filled if they have data), MC core, tilted frame axes
+    :param ax: matplotlib axes
+    :param event: EventRecord
+    :param axis: reconstructed ShowerAxis to draw the reconstructed core (see reconstruct_axis). None for no core
+    """
+    table = event.subarray.to_table()
+    x = table['tel_pos_x'].to('m').value
+    y = table['tel_pos_y'].to('m').value
+    types = np.array([str(description).split(':')[0] for description in table['tel_description']])
+    with_data = np.isin(table['tel_id'], list(event.images))
+
+    for tel_type in np.unique(types):
+        colour = TEL_COLOURS.get(tel_type, 'tab:blue')
+        sel = types == tel_type
+        ax.scatter(x[sel & with_data], y[sel & with_data], s=30, c=colour, label=tel_type)
+        ax.scatter(x[sel & ~with_data], y[sel & ~with_data], s=30, facecolors='none', edgecolors=colour)
+    if len(table) <= 50:
+        for tel_id, xt, yt in zip(table['tel_id'], x, y):
+            ax.annotate(str(tel_id), (xt, yt), fontsize=6, xytext=(3, 3), textcoords='offset points')
+
+    ax.plot(event.core_x.to('m').value, event.core_y.to('m').value, 'r+', markersize=15, mew=2, label='MC core')
+    if axis is not None:
+        ax.plot(axis.core_x.to('m').value, axis.core_y.to('m').value, 'b+', markersize=15, mew=2, label='reco core')
+
+    # tilted frame axes projected on the ground
+    rot = tilted_rotation(event.run_array_direction[1], event.run_array_direction[0])
+    extent = max(np.max(np.abs(np.concatenate((x, y)))), 100.)
+    # (the pointing is along x_tilted for az = 0: its label is moved below)
+    for column, label, colour, offset in [(0, 'x_tilted', 'r', (2, 2)), (1, 'y_tilted', 'g', (2, 2)),
+                                          (2, 'pointing', 'm', (2, -10))]:
+        vector = 0.3 * extent * rot[:2, column]
+        ax.annotate('', xy=vector, xytext=(0, 0), arrowprops=dict(arrowstyle='->', color=colour))
+        ax.annotate(label, xy=vector, xytext=offset, textcoords='offset points', color=colour, fontsize=8)
+
+    ax.set_xlabel('x_gnd = NORTH [m]')
+    ax.set_ylabel('y_gnd = WEST [m]')
+    ax.set_aspect('equal')
+    ax.legend(loc='upper right', fontsize=7)
+    ax.set_title('event {0}, alt {1:.1f}, az {2:.1f}'.format(event.event_id,
+                                                              event.run_array_direction[1].to('deg').value,
+                                                              event.run_array_direction[0].to('deg').value))
+
+
+def camera_view(ax, event, tel_id, hillas=None, mask=None):
+    """
+    Pixels of a camera with the colors of draw_camera (cleaned image)
+    :param ax: matplotlib axes
+    :param event: EventRecord
+    :param tel_id: telescope ID
+    :param hillas: Hillas parameters of the image (row of batched_hillas) to draw the ellipse. None for no ellipse
+    :param mask: cleaning mask of the image (see batched_clean). None to clean the image here
+    """
+    camera = event.subarray.tel[tel_id].camera
+    colours, _ = image_colours(camera, event.images[tel_id], tail_cut_bool=True, mask=mask)
+    ax.scatter(camera.pix_x.to('m').value, camera.pix_y.to('m').value, c=colours, s=2, marker='h', linewidths=0)
+    if hillas is not None and np.isfinite(hillas['psi']):
+        ax.add_patch(Ellipse((hillas['x'], hillas['y']), 2 * hillas['length'], 2 * hillas['width'],
+                             angle=np.rad2deg(hillas['psi']), fill=False, color='r'))
+    ax.set_title('{0} {1}'.format(tel_id, camera.cam_id), fontsize=7)
+    ax.set_aspect('equal')
+    ax.set_axis_off()
+
+
+def write_preview(event, filename, max_cameras=9, hillas=None, axis=None, masks=None):
+    """
+    Quick-look PNG of an event, without OpenSCAD: ground view of the array and the brightest camera images
+    :param event: EventRecord
+    :param filename: output PNG
+    :param max_cameras: number of cameras shown (the brightest ones)
+    :param hillas: Hillas parameters (see batched_hillas) to draw the ellipses. None for no ellipses
+    :param axis: reconstructed ShowerAxis (see reconstruct_axis). None for no reconstructed core
+    :param masks: cleaning masks of the images (see batched_clean). None to clean the images here
+    """
+    tel_ids = sorted(event.images, key=lambda tel_id: -np.sum(event.images[tel_id]))[:max_cameras]
+    n_cols = int(np.ceil(np.sqrt(len(tel_ids)))) if tel_ids else 1
+    n_rows = int(np.ceil(len(tel_ids) / n_cols)) if tel_ids else 1
+    hillas_by_tel = {} if hillas is None else {row['tel_id']: row for row in hillas}
+
+    fig = Figure(figsize=(14, 7))
+    FigureCanvasAgg(fig)
+    grid = GridSpec(n_rows, 2 * n_cols, figure=fig)
+    ground_view(fig.add_subplot(grid[:, :n_cols]), event, axis=axis)
+    for k, tel_id in enumerate(tel_ids):
+        row, col = divmod(k, n_cols)
+        camera_view(fig.add_subplot(grid[row, n_cols + col]), event, tel_id, hillas=hillas_by_tel.get(tel_id),
+                    mask=None if masks is None else masks.get(tel_id))
+    fig.savefig(filename, dpi=80)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Quick-look PNG of every event of a file, to choose the events to render")
+    parser.add_argument('filename', help="simtel file (or synthetic source)")
+    parser.add_argument('--out-dir', default='previews', help="directory of the PNG files")
+    parser.add_argument('--max-events', type=int, default=None, help="maximum number of events")
+    parser.add_argument('--max-cameras', type=int, default=9, help="cameras shown for each event")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    for event in calibrated_events(args.filename, max_events=args.max_events):
+        record = EventRecord.from_event(event)
+        if not record.images:
+            continue
+        out = os.path.join(args.out_dir, 'preview_{0}.png'.format(record.event_id))
+        write_preview(record, out, max_cameras=args.max_cameras)
+        print(out)
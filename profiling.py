@@ -0,0 +1,216 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class _NoStage(object):
+    """
+    Do-nothing context manager, used when the profiler is disabled
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Profiler(object):
+    """
+    Record wall-clock time of each stage of a run, plus the number of SolidPython nodes of the subtrees
+    and the bytes written. Stages can be nested and repeated (e.g. one 'camera build' for each telescope):
+    the report keeps every call and a summary by name.
+    With memory=True the peak traced memory of each stage (above the memory in use when it starts) is
+    also recorded: tracemalloc slows the run down, so the times of such a run are inflated.
+
+    example:
+
+    profiler = enable()
+    with stage('calibration'):
+        cal.calibrate(event)
+    profiler.write('report.json')
+    """
+
+    def __init__(self, enabled=True, memory=False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.stages = []
+        self.nodes = []
+        self.bytes_written = {}
+        self._depth = 0
+        self._peaks = []
+        self._total_peak = None
+        # the stages reset the tracemalloc peak: the peak of the run is kept here
+        self._run_peak = 0
+        self._t0 = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _enter_memory(self):
+        # absolute peak of the parent stage up to now, then start a new peak for this stage
+        current, peak = tracemalloc.get_traced_memory()
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        self._run_peak = max(self._run_peak, peak)
+        tracemalloc.reset_peak()
+        self._peaks.append(current)
+        return current
+
+    def _exit_memory(self):
+        peak = max(tracemalloc.get_traced_memory()[1], self._peaks.pop())
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        self._run_peak = max(self._run_peak, peak)
+        return peak
+
+    @contextmanager
+    def _stage(self, name, info):
+        start_bytes = self._enter_memory() if self.memory else 0
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            self._depth -= 1
+            record = {'stage': name, 'wall_s': wall, 'depth': self._depth}
+            if self.memory:
+                record['peak_bytes'] = self._exit_memory() - start_bytes
+            record.update(info)
+            self.stages.append(record)
+
+    def stage(self, name, **info):
+        """
+        :param name: name of the stage
+        :param info: extra values saved with the stage (e.g. tel_id)
+        :return: context manager timing the stage
+        """
+        if not self.enabled:
+            return _NoStage()
+        return self._stage(name, info)
+
+    def skip(self, name, reason, **info):
+        """
+        Record a stage which is not run (e.g. the calibration of an already calibrated source)
+        :param name: name of the stage
+        :param reason: why the stage is skipped
+        """
+        if self.enabled:
+            record = {'stage': name, 'wall_s': 0., 'depth': self._depth, 'skipped': reason}
+            record.update(info)
+            self.stages.append(record)
+
+    def stop(self):
+        """
+        Stop tracing the memory, keeping the peak of the whole run
+        """
+        if self.memory and tracemalloc.is_tracing():
+            self._total_peak = self.total_peak()
+            tracemalloc.stop()
+
+    def total_peak(self):
+        """
+        :return: peak traced memory of the whole run (0 if the memory is not measured)
+        """
+        if self._total_peak is not None:
+            return self._total_peak
+        if self.memory and tracemalloc.is_tracing():
+            return max(self._run_peak, tracemalloc.get_traced_memory()[1])
+        return 0
+
+    def count_nodes(self, name, obj, **info):
+        """
+        Count the SolidPython nodes of a subtree
+        :param name: name of the subtree
+        :param obj: root of the subtree
+        :param info: extra values saved with the count (e.g. tel_id)
+        :return: number of nodes
+        """
+        if not self.enabled:
+            return 0
+        n_nodes = count_nodes(obj)
+        record = {'subtree': name, 'nodes': n_nodes}
+        record.update(info)
+        self.nodes.append(record)
+        return n_nodes
+
+    def add_bytes(self, filename, n_bytes):
+        if self.enabled:
+            self.bytes_written[filename] = self.bytes_written.get(filename, 0) + n_bytes
+
+    def report(self):
+        """
+        :return: dictionary with all the stages, a summary by stage name, node counts and bytes written
+        """
+        summary = {}
+        for record in self.stages:
+            entry = summary.setdefault(record['stage'], {'calls': 0, 'wall_s': 0., 'max_wall_s': 0., 'peak_bytes': 0})
+            if 'skipped' in record:
+                entry['skipped'] = entry.get('skipped', 0) + 1
+                continue
+            entry['calls'] += 1
+            entry['wall_s'] += record['wall_s']
+            entry['max_wall_s'] = max(entry['max_wall_s'], record['wall_s'])
+            entry['peak_bytes'] = max(entry['peak_bytes'], record.get('peak_bytes', 0))
+
+        return {'total_wall_s': time.perf_counter() - self._t0,
+                'peak_bytes': self.total_peak(),
+                'summary': summary,
+                'stages': self.stages,
+                'nodes': self.nodes,
+                'bytes_written': self.bytes_written}
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+        print("profile report written to {0}".format(filename))
+
+
+def count_nodes(obj):
+    """
+    Number of nodes of a SolidPython tree (root included)
+    :param obj: root of the tree
+    :return: number of nodes
+    """
+    n_nodes = 0
+    to_visit = [obj]
+    while to_visit:
+        node = to_visit.pop()
+        n_nodes += 1
+        to_visit.extend(getattr(node, 'children', []))
+    return n_nodes
+
+
+# profiler used by the stage() calls spread in the code. Disabled until enable() is called
+_active = Profiler(enabled=False)
+
+
+def enable(memory=False):
+    """
+    Start a new profiler and make it the active one
+    :param memory: (bool) also measure the peak memory of the stages with tracemalloc (slower)
+    :return: Profiler
+    """
+    global _active
+    if not memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _active = Profiler(enabled=True, memory=memory)
+    return _active
+
+
+def get_profiler():
+    return _active
+
+
+def stage(name, **info):
+    """
+    Time a stage with the active profiler (no-op if profiling is not enabled)
+    """
+    return _active.stage(name, **info)
+
+
+def skip(name, reason, **info):
+    """
+    Report a stage which is not run to the active profiler (no-op if profiling is not enabled)
+    """
+    _active.skip(name, reason, **info)
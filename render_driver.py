@@ -0,0 +1,208 @@
+import os
+import re
+import sys
+import glob
+import time
+import shutil
+import signal
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'creed_renders')
+
+# extra OpenSCAD options for the image exports
+PNG_ARGS = ['--viewall', '--autocenter', '--imgsize=1600,1200']
+
+INCLUDE_RE = re.compile(r'^\s*(?:include|use)\s*<([^>]+)>', re.MULTILINE)
+
+
+def scad_files(paths):
+    """
+    :param paths: SCAD files or directories (all the .scad files inside are taken)
+    :return: sorted list of SCAD files
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, '*.scad')))
+        else:
+            files.append(path)
+    return sorted(set(files))
+
+
+def source_root(scad_files):
+    """
+    :param scad_files: SCAD files
+    :return: deepest directory containing all the files: the outputs mirror the paths relative to it
+    """
+    if not scad_files:
+        return ''
+    return os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in scad_files])
+
+
+def content_hash(scad_file, options=(), _seen=None):
+    """
+    Hash of a SCAD file, of the files it includes (e.g. the static scene of the animation frames)
+    and of the OpenSCAD options: two jobs with the same hash give the same artifact.
+    :param scad_file: SCAD file
+    :param options: output format and OpenSCAD options
+    :return: sha256 hex digest
+    """
+    seen = set() if _seen is None else _seen
+    digest = hashlib.sha256()
+    digest.update(repr(tuple(options)).encode())
+    with open(scad_file, 'rb') as f:
+        content = f.read()
+    digest.update(content)
+    seen.add(os.path.abspath(scad_file))
+    for name in INCLUDE_RE.findall(content.decode(errors='replace')):
+        included = os.path.join(os.path.dirname(scad_file), name)
+        if os.path.exists(included) and os.path.abspath(included) not in seen:
+            digest.update(content_hash(included, _seen=seen).encode())
+    return digest.hexdigest()
+
+
+class RenderJob(object):
+    """
+    One OpenSCAD export: SCAD file -> artifact (stl, png, ...) in the output directory,
+    at the path of the SCAD file relative to root (a/x.scad and b/x.scad give a/x.stl and b/x.stl)
+    """
+    __slots__ = ('scad_file', 'output', 'fmt', 'key', 'status', 'wall_s', 'message')
+
+    def __init__(self, scad_file, out_dir, fmt, options, root=None):
+        self.scad_file = scad_file
+        name = os.path.relpath(os.path.abspath(scad_file), root) if root else os.path.basename(scad_file)
+        self.output = os.path.join(out_dir, os.path.splitext(name)[0] + '.' + fmt)
+        self.fmt = fmt
+        self.key = content_hash(scad_file, [fmt] + list(options))
+        self.status = 'pending'
+        self.wall_s = 0.
+        self.message = ''
+
+
+def run_job(job, command, cache_dir, timeout):
+    """
+    Run OpenSCAD on a job and store the artifact in the cache (<hash>.<fmt>), then copy it to the output
+    :param job: RenderJob
+    :param command: OpenSCAD command (list, e.g. ['openscad'] or ['xvfb-run', '-a', 'openscad']) + options
+    :param cache_dir: cache directory
+    :param timeout: maximum time of the job (s): OpenSCAD is killed after it
+    :return: job, with status 'rendered', 'timeout' or 'failed'
+    """
+    cached = os.path.join(cache_dir, job.key + '.' + job.fmt)
+    # OpenSCAD takes the export format from the extension
+    partial = os.path.join(cache_dir, job.key + '.partial.' + job.fmt)
+    start = time.perf_counter()
+    try:
+        # own process group: on timeout OpenSCAD is killed also when started through xvfb-run
+        process = subprocess.Popen(command + ['-o', partial, job.scad_file],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    except OSError as err:
+        job.status = 'failed'
+        job.message = str(err)
+        job.wall_s = time.perf_counter() - start
+        return job
+    try:
+        _, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.communicate()
+        job.status = 'timeout'
+        job.message = 'killed after {0} s'.format(timeout)
+    else:
+        if process.returncode == 0 and os.path.exists(partial):
+            os.replace(partial, cached)
+            shutil.copyfile(cached, job.output)
+            job.status = 'rendered'
+        else:
+            job.status = 'failed'
+            # last line of the OpenSCAD log: usually the error
+            lines = stderr.decode(errors='replace').strip().splitlines()
+            job.message = lines[-1] if lines else 'exit code {0}'.format(process.returncode)
+    job.wall_s = time.perf_counter() - start
+    if job.status != 'rendered' and os.path.exists(partial):
+        os.remove(partial)
+    return job
+
+
+def render_all(paths, out_dir='renders', fmt='stl', jobs=None, timeout=600., cache_dir=DEFAULT_CACHE_DIR,
+               openscad='openscad', xvfb=False, options=()):
+    """
+    Render SCAD files with the local OpenSCAD, N at a time. A file whose content (with its includes and the
+    options) has already been rendered is not rendered again: the artifact is copied from the cache.
+    Files with the same content in one call are rendered once, then copied to all their outputs.
+    The pool only waits for the OpenSCAD processes, so threads are enough to keep N cores busy.
+    :param paths: SCAD files or directories
+    :param out_dir: directory of the artifacts
+    :param fmt: output format (extension): stl, off, amf, 3mf, png...
+    :param jobs: number of parallel OpenSCAD processes. None for the number of cores
+    :param timeout: maximum time of each job (s)
+    :param cache_dir: directory of the cached artifacts
+    :param openscad: OpenSCAD executable
+    :param xvfb: (bool) run OpenSCAD in xvfb-run, for the PNG exports on machines without a display
+    :param options: extra OpenSCAD options. PNG_ARGS are added for the png format
+    :return: list of RenderJob
+    """
+    options = list(options) + (PNG_ARGS if fmt == 'png' else [])
+    command = (['xvfb-run', '-a'] if xvfb else []) + [openscad] + options
+    for directory in [out_dir, cache_dir]:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    files = scad_files(paths)
+    root = source_root(files)
+    # key -> jobs with that content: one render (two processes would write the same partial file)
+    todo = {}
+    done = []
+    for scad_file in files:
+        job = RenderJob(scad_file, out_dir, fmt, options, root=root)
+        output_dir = os.path.dirname(job.output)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        cached = os.path.join(cache_dir, job.key + '.' + fmt)
+        if os.path.exists(cached):
+            shutil.copyfile(cached, job.output)
+            job.status = 'cached'
+            done.append(job)
+        else:
+            todo.setdefault(job.key, []).append(job)
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = [pool.submit(run_job, same[0], command, cache_dir, timeout) for same in todo.values()]
+        for future, same in zip(futures, todo.values()):
+            job = future.result()
+            for duplicate in same[1:]:
+                if job.status == 'rendered':
+                    shutil.copyfile(os.path.join(cache_dir, job.key + '.' + fmt), duplicate.output)
+                    duplicate.status = 'cached'
+                else:
+                    duplicate.status = job.status
+                    duplicate.message = job.message
+            for job in same:
+                print("{0:8s} {1:7.1f} s {2} {3}".format(job.status, job.wall_s, job.output, job.message))
+                done.append(job)
+    return done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render SCAD files with OpenSCAD in parallel, re-using cached artifacts")
+    parser.add_argument('paths', nargs='+', help="SCAD files or directories with SCAD files")
+    parser.add_argument('--out-dir', default='renders', help="directory of the artifacts")
+    parser.add_argument('--format', default='stl', help="output format: stl, off, amf, 3mf, png...")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="parallel OpenSCAD processes (default: cores)")
+    parser.add_argument('--timeout', type=float, default=600., help="maximum time of each render (s)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help="directory of the cached artifacts")
+    parser.add_argument('--openscad', default='openscad', help="OpenSCAD executable")
+    parser.add_argument('--xvfb', action='store_true', help="run OpenSCAD in xvfb-run (PNG without a display)")
+    args, options = parser.parse_known_args()
+
+    start = time.perf_counter()
+    results = render_all(args.paths, out_dir=args.out_dir, fmt=args.format, jobs=args.jobs, timeout=args.timeout,
+                         cache_dir=args.cache_dir, openscad=args.openscad, xvfb=args.xvfb, options=options)
+    counts = {}
+    for job in results:
+        counts[job.status] = counts.get(job.status, 0) + 1
+    print("{0} jobs in {1:.1f} s: {2}".format(len(results), time.perf_counter() - start, counts))
+    sys.exit(1 if counts.get('failed') or counts.get('timeout') else 0)
@@ -0,0 +1,253 @@
+from abc import ABCMeta, abstractmethod
+import numpy as np
+from solid.solidpython import OpenSCADObject
+from solid.utils import translate, rotate, union, color, cylinder, sphere
+
+
+def scad_vector(values, fmt='%.6g'):
+    """
+    OpenSCAD vector (or list of vectors) from a numpy array
+    """
+    values = np.asarray(values)
+    if values.ndim == 1:
+        return '[' + ','.join(fmt % v for v in values) + ']'
+    return '[' + ','.join(scad_vector(row, fmt) for row in values) + ']'
+
+
+class ArrayNode(OpenSCADObject, metaclass=ABCMeta):
+    """
+    Leaf of the SolidPython tree holding many primitives of the same kind in NumPy arrays.
+    It is rendered as one OpenSCAD loop over data vectors, without one Python object for each primitive.
+    The primitives can also be exported as a triangle mesh (to_mesh) or converted back to SolidPython (to_solid).
+    """
+
+    def __init__(self, name):
+        OpenSCADObject.__init__(self, name=name, params={})
+        self._scad_text = None
+
+    @property
+    def scad_text(self):
+        if self._scad_text is None:
+            # no loop over an empty range (OpenSCAD warns about [0 : -1])
+            self._scad_text = self._render_arrays() if self.n_primitives() else "\nunion();"
+        return self._scad_text
+
+    def _render(self, render_holes=False):
+        return self.scad_text
+
+    @abstractmethod
+    def n_primitives(self):
+        """
+        :return: number of primitives
+        """
+
+    @abstractmethod
+    def _render_arrays(self):
+        """
+        :return: OpenSCAD code of the primitives (at least one)
+        """
+
+    @abstractmethod
+    def to_solid(self):
+        """
+        :return: equivalent SolidPython tree, one object for each primitive
+        """
+
+    @abstractmethod
+    def to_mesh(self):
+        """
+        :return: vertices (V, 3), triangles (F, 3), vertex colors (V, 4)
+        """
+
+
+def _colours_text(colours):
+    # either a (N, 4) array or the name of an OpenSCAD variable defined elsewhere (e.g. animation frames)
+    if isinstance(colours, str):
+        return colours
+    return scad_vector(colours, '%.4g')
+
+
+class PrismBatch(ArrayNode):
+    """
+    Vertical prisms (cylinders with few sides) on the xy plane, one color each: the pixels of a camera.
+    Same geometry as translate([x, y])(cylinder(r=radius, h=height, segments=sides)).
+    """
+
+    def __init__(self, centers, radius, height, colours, sides=6):
+        """
+        :param centers: (N, 2) array of the centers
+        :param radius: radius of the circumscribed circle
+        :param height: height of the prisms
+        :param colours: (N, 4) array of RGBA colors, or name of an OpenSCAD variable with the colors
+        :param sides: number of sides
+        """
+        ArrayNode.__init__(self, name='prism_batch')
+        self.centers = np.asarray(centers, dtype=float)
+        self.radius = float(radius)
+        self.height = float(height)
+        self.colours = colours if isinstance(colours, str) else np.asarray(colours, dtype=float)
+        self.sides = sides
+
+    def n_primitives(self):
+        return len(self.centers)
+
+    def _render_arrays(self):
+        return ("\nunion() {"
+                "\n\tpix_pos = " + scad_vector(self.centers) + ";"
+                "\n\tpix_col = " + _colours_text(self.colours) + ";"
+                "\n\tfor (i = [0 : {0}]) color(pix_col[i]) translate(pix_pos[i]) "
+                "cylinder($fn = {1}, h = {2:.6g}, r = {3:.6g});".format(len(self.centers) - 1, self.sides,
+                                                                        self.height, self.radius) +
+                "\n}")
+
+    def to_solid(self):
+        pixels = union()
+        for center, colore in zip(self.centers, self.colours):
+            pixels.add(color(list(colore))(translate(list(center))(cylinder(r=self.radius, h=self.height,
+                                                                           segments=self.sides))))
+        return pixels
+
+    def to_mesh(self):
+        """
+        :return: vertices (V, 3), triangles (F, 3), vertex colors (V, 4)
+        """
+        n = len(self.centers)
+        k = self.sides
+        angles = 2 * np.pi * np.arange(k) / k
+        ring = self.radius * np.stack((np.cos(angles), np.sin(angles)), axis=1)
+
+        # vertices: bottom ring then top ring for each prism
+        xy = self.centers[:, np.newaxis, :] + ring[np.newaxis, :, :]
+        vertices = np.zeros((n, 2 * k, 3))
+        vertices[:, :k, :2] = xy
+        vertices[:, k:, :2] = xy
+        vertices[:, k:, 2] = self.height
+
+        # faces of one prism: bottom and top fans, then two triangles per side
+        j = np.arange(1, k - 1)
+        bottom = np.stack((np.zeros(k - 2, dtype=int), j + 1, j), axis=1)
+        top = np.stack((np.full(k - 2, k), k + j, k + j + 1), axis=1)
+        i = np.arange(k)
+        i1 = (i + 1) % k
+        sides = np.concatenate((np.stack((i, i1, k + i1), axis=1), np.stack((i, k + i1, k + i), axis=1)))
+        faces = np.concatenate((bottom, top, sides))
+        faces = (faces[np.newaxis, :, :] + 2 * k * np.arange(n)[:, np.newaxis, np.newaxis]).reshape(-1, 3)
+
+        colours = np.repeat(np.asarray(self.colours, dtype=float), 2 * k, axis=0)
+        return vertices.reshape(-1, 3), faces, colours
+
+
+class SegmentBatch(ArrayNode):
+    """
+    Cylinders connecting consecutive points of a 2D curve: same geometry as utilities.arco
+    (cylinder of length |P[i+1] - P[i]| rotated along the segment and translated to P[i]).
+    """
+
+    def __init__(self, x, y, radius):
+        """
+        :param x: np.array with the x points
+        :param y: np.array with the "heights"
+        :param radius: radius of the cylinders
+        """
+        ArrayNode.__init__(self, name='segment_batch')
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.begin = np.stack((x[:-1], y[:-1]), axis=1)
+        self.angle = np.rad2deg(np.arctan((y[:-1] - y[1:]) / (x[:-1] - x[1:])))
+        self.length = np.hypot(x[1:] - x[:-1], y[1:] - y[:-1])
+        self.radius = float(radius)
+
+    def n_primitives(self):
+        return len(self.length)
+
+    def _render_arrays(self):
+        return ("\nunion() {"
+                "\n\tseg_beg = " + scad_vector(self.begin) + ";"
+                "\n\tseg_ang = " + scad_vector(self.angle) + ";"
+                "\n\tseg_len = " + scad_vector(self.length) + ";"
+                "\n\tfor (i = [0 : {0}]) translate(seg_beg[i]) rotate([0, 0, seg_ang[i]]) rotate([0, 90, 0]) "
+                "cylinder(h = seg_len[i], r = {1:.6g});".format(len(self.length) - 1, self.radius) +
+                "\n}")
+
+    def to_solid(self):
+        segments = union()
+        for begin, angle, length in zip(self.begin, self.angle, self.length):
+            segment = rotate([0, 90, 0])(cylinder(h=length, r=self.radius))
+            segments.add(translate(list(begin))(rotate([0, 0, angle])(segment)))
+        return segments
+
+    def to_mesh(self, sides=8):
+        """
+        :param sides: sides of each cylinder
+        :return: vertices (V, 3), triangles (F, 3), vertex colors (V, 4) (white)
+        """
+        n = len(self.length)
+        angles = 2 * np.pi * np.arange(sides) / sides
+        # circle in the plane orthogonal to the segment direction (x', after the rotations)
+        ring_y = self.radius * np.cos(angles)
+        ring_z = self.radius * np.sin(angles)
+
+        theta = np.deg2rad(self.angle)[:, np.newaxis]
+        direction = np.stack((np.cos(theta), np.sin(theta)), axis=2)[:, 0, :]
+        normal = np.stack((-np.sin(theta), np.cos(theta)), axis=2)[:, 0, :]
+
+        vertices = np.zeros((n, 2 * sides, 3))
+        for end, offset in ((0, 0.), (1, 1.)):
+            xy = (self.begin[:, np.newaxis, :] + offset * self.length[:, np.newaxis, np.newaxis] * direction[:, np.newaxis, :]
+                  + ring_y[np.newaxis, :, np.newaxis] * normal[:, np.newaxis, :])
+            vertices[:, end * sides:(end + 1) * sides, :2] = xy
+            vertices[:, end * sides:(end + 1) * sides, 2] = ring_z
+
+        i = np.arange(sides)
+        i1 = (i + 1) % sides
+        faces = np.concatenate((np.stack((i, i1, sides + i1), axis=1), np.stack((i, sides + i1, sides + i), axis=1)))
+        faces = (faces[np.newaxis, :, :] + 2 * sides * np.arange(n)[:, np.newaxis, np.newaxis]).reshape(-1, 3)
+        return vertices.reshape(-1, 3), faces, np.ones((n * 2 * sides, 4))
+
+
+class MarkerBatch(ArrayNode):
+    """
+    Spheres of the same radius and color at many positions (e.g. telescope positions on the ground)
+    """
+
+    def __init__(self, positions, radius, colour):
+        """
+        :param positions: (N, 2) or (N, 3) array of the centers
+        :param radius: radius of the spheres
+        :param colour: RGB(A) color
+        """
+        ArrayNode.__init__(self, name='marker_batch')
+        self.positions = np.asarray(positions, dtype=float)
+        self.radius = float(radius)
+        self.colour = list(colour)
+
+    def n_primitives(self):
+        return len(self.positions)
+
+    def _render_arrays(self):
+        return ("\ncolor(" + scad_vector(self.colour, '%.4g') + ") union() {"
+                "\n\tmark_pos = " + scad_vector(self.positions) + ";"
+                "\n\tfor (i = [0 : {0}]) translate(mark_pos[i]) sphere(r = {1:.6g});".format(len(self.positions) - 1,
+                                                                                           self.radius) +
+                "\n}")
+
+    def to_solid(self):
+        markers = union()
+        for position in self.positions:
+            markers.add(translate(list(position))(sphere(r=self.radius)))
+        return color(self.colour)(markers)
+
+    def to_mesh(self):
+        """
+        Spheres as octahedra
+        :return: vertices (V, 3), triangles (F, 3), vertex colors (V, 4)
+        """
+        n = len(self.positions)
+        positions = np.zeros((n, 3))
+        positions[:, :self.positions.shape[1]] = self.positions
+        corners = self.radius * np.array([[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]])
+        faces = np.array([[0, 2, 4], [2, 1, 4], [1, 3, 4], [3, 0, 4], [2, 0, 5], [1, 2, 5], [3, 1, 5], [0, 3, 5]])
+        vertices = positions[:, np.newaxis, :] + corners[np.newaxis, :, :]
+        faces = (faces[np.newaxis, :, :] + 6 * np.arange(n)[:, np.newaxis, np.newaxis]).reshape(-1, 3)
+        colour = (self.colour + [1.])[:4]
+        return vertices.reshape(-1, 3), faces, np.tile(colour, (n * 6, 1))
@@ -0,0 +1,352 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import argparse
+import functools
+import numpy as np
+from urllib.parse import urlparse
+
+from array_scene import load_calibrate
+from camera_event import image_colours, camera_pixels, camera_height
+from telescope_selection import select_telescopes, n_telescopes
+from telescope_structure import (LST_MIRROR_RADIUS, LST_ARCH_X, LST_ARCH_Y, LST_ARCH_RADIUS, LST_CAMERA_FRAME,
+                                 MST_RADIUS, MST_HEIGHT, MST_RATIO_CAM, MST_CAMERA_SIDE, MST_CAMERA_THICKNESS,
+                                 SPIDER_RADIUS, SPIDER_BASE, CAMERA_OFFSET)
+from scene_arrays import SegmentBatch, MarkerBatch
+from utilities import rotation
+
+VIEWER_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'viewer.html')
+
+GRID_UNIT = 20000  # in centimeters, as ground_grid
+
+
+def _translation(vector):
+    matrix = np.eye(4)
+    matrix[:3, 3] = vector
+    return matrix
+
+
+def _rotation(angle, axis):
+    return np.array(rotation(angle, axis))
+
+
+def transform(vertices, matrix):
+    """
+    :param vertices: (V, 3) vertices
+    :param matrix: 4x4 transformation (as multmatrix)
+    :return: transformed vertices
+    """
+    return vertices.dot(matrix[:3, :3].T) + matrix[:3, 3]
+
+
+def merge_meshes(meshes):
+    """
+    :param meshes: list of (vertices, faces, colours)
+    :return: one mesh (vertices, faces, colours)
+    """
+    offsets = np.cumsum([0] + [len(vertices) for vertices, _, _ in meshes[:-1]])
+    return (np.concatenate([vertices for vertices, _, _ in meshes]),
+            np.concatenate([faces + offset for (_, faces, _), offset in zip(meshes, offsets)]),
+            np.concatenate([colours for _, _, colours in meshes]))
+
+
+def box_mesh(center, size, colour):
+    """
+    Box, same as translate(center)(cube(size, center=True))
+    """
+    corners = np.array([[x, y, z] for z in (-0.5, 0.5) for y in (-0.5, 0.5) for x in (-0.5, 0.5)])
+    vertices = corners * np.asarray(size, dtype=float) + np.asarray(center, dtype=float)
+    faces = np.array([[0, 2, 1], [1, 2, 3], [4, 5, 6], [5, 7, 6], [0, 1, 4], [1, 5, 4],
+                      [2, 6, 3], [3, 6, 7], [0, 4, 2], [2, 4, 6], [1, 3, 5], [3, 7, 5]])
+    return vertices, faces, np.tile(np.append(colour, 1.)[:4], (8, 1))
+
+
+def beam_mesh(begin, end, width, colour):
+    """
+    Box of square section between two points (e.g. the spiders of the MSTs)
+    """
+    begin = np.asarray(begin, dtype=float)
+    end = np.asarray(end, dtype=float)
+    axis = end - begin
+    vertices, faces, colours = box_mesh([0, 0, 0.5], [width, width, 1.], colour)
+    vertices[:, 2] *= np.linalg.norm(axis)
+    # rotate z to the beam direction
+    direction = axis / np.linalg.norm(axis)
+    tilt = np.rad2deg(np.arccos(np.clip(direction[2], -1, 1)))
+    turn = np.rad2deg(np.arctan2(direction[1], direction[0]))
+    matrix = _translation(begin).dot(_rotation(turn, 'z')).dot(_rotation(tilt, 'y'))
+    return transform(vertices, matrix), faces, colours
+
+
+def disc_mesh(radius, z, colour, sides=32):
+    angles = 2 * np.pi * np.arange(sides) / sides
+    vertices = np.zeros((sides + 1, 3))
+    vertices[1:, 0] = radius * np.cos(angles)
+    vertices[1:, 1] = radius * np.sin(angles)
+    vertices[:, 2] = z
+    faces = np.stack((np.zeros(sides, dtype=int), 1 + np.arange(sides), 1 + (np.arange(sides) + 1) % sides), axis=1)
+    return vertices, faces, np.tile(np.append(colour, 1.)[:4], (sides + 1, 1))
+
+
+def structure_mesh(tel_type):
+    """
+    Simplified mesh of the telescope structure along z (before the pointing): mirror as a disc,
+    camera frame, LST arch or MST spiders, with the dimensions of telescope_body. The OpenSCAD scene has the full
+    CSG geometry.
+    :param tel_type: 'LST' or 'MST'
+    :return: vertices, faces, colours
+    """
+    if tel_type == 'LST':
+        arch = SegmentBatch(LST_ARCH_X, LST_ARCH_Y, LST_ARCH_RADIUS).to_mesh()
+        matrix = _translation([0, 0, CAMERA_OFFSET['LST']]).dot(_rotation(-90, 'x')).dot(_rotation(-90, 'y'))
+        arch = (transform(arch[0], matrix), arch[1], np.tile([1., 0, 0, 1], (len(arch[0]), 1)))
+        return merge_meshes([disc_mesh(LST_MIRROR_RADIUS, 0, [1, 0, 0]),
+                             arch,
+                             box_mesh([0, 0, CAMERA_OFFSET['LST']], LST_CAMERA_FRAME, [0.6, 0.6, 0.6])])
+    radius_top = MST_RADIUS / MST_RATIO_CAM
+    meshes = [disc_mesh(MST_RADIUS, 0, [1, 0, 0]),
+              box_mesh([0, 0, CAMERA_OFFSET['MST']], [MST_CAMERA_SIDE, MST_CAMERA_SIDE, MST_CAMERA_THICKNESS],
+                       [0.6, 0.6, 0.6])]
+    for angle in np.deg2rad(45 + 90 * np.arange(4)):
+        direction = np.array([np.cos(angle), np.sin(angle), 0])
+        meshes.append(beam_mesh(MST_RADIUS * direction + [0, 0, SPIDER_BASE],
+                                radius_top * direction + [0, 0, MST_HEIGHT], 2 * SPIDER_RADIUS, [0.8, 0.8, 0.8]))
+    return merge_meshes(meshes)
+
+
+def pointing_matrix(pointing):
+    """
+    Same rotation as point_structure
+    """
+    zen = 90 - pointing['alt'].value
+    az = pointing['az'].value
+    return _rotation(-az, 'z').dot(_rotation(zen, 'y')).dot(_rotation(-90, 'z'))
+
+
+def camera_matrix(camera, tel_type, scale_cam=1.6):
+    """
+    Transformations of the camera display inside telescope() with sim_to_real=True (see camera_image)
+    """
+    cam_height = camera_height(camera)
+    display = _translation([0, 0, cam_height / 2]).dot(_rotation(180, 'y'))
+    return (_translation([0, 0, CAMERA_OFFSET[tel_type]]).dot(_rotation(180, 'x')).dot(_rotation(90, 'z'))
+            .dot(display))
+
+
+def ground_meshes(event, tel_ids):
+    """
+    Meshes available before any telescope is built: ground grid, telescope positions, MC core
+    :return: list of (name, mesh)
+    """
+    positions = 100 * np.array([event.subarray.positions[tel_id].to('m').value for tel_id in event.subarray.tel])
+    # same lines as grid_plane(grid_unit=GRID_UNIT, count=count)
+    count = 2 * int(np.max(np.abs(positions[:, 0])) / GRID_UNIT)
+    length = count * GRID_UNIT
+    lines = []
+    for k in range(-count // 2, count // 2 + 1):
+        lines.append(box_mesh([k * GRID_UNIT, 0, 0], [200, length, 10], [0, 0, 1]))
+        lines.append(box_mesh([0, k * GRID_UNIT, 0], [length, 200, 10], [0, 0, 1]))
+
+    selected = np.isin(list(event.subarray.tel), tel_ids)
+    core = [event.core_x.to('cm').value, event.core_y.to('cm').value, 0]
+    cross = merge_meshes([box_mesh(core, [5000, 400, 200], [1, 0, 0]), box_mesh(core, [400, 5000, 200], [1, 0, 0])])
+    meshes = [('ground grid', merge_meshes(lines)), ('MC core', cross)]
+    for name, sel, colour in [('telescopes', selected, [0, 1, 0]), ('other telescopes', ~selected, [0.5, 0.5, 0.5])]:
+        if np.any(sel):
+            meshes.append((name, MarkerBatch(positions[sel], radius=800, colour=colour).to_mesh()))
+    return meshes
+
+
+def telescope_meshes(event, tel_id, structures, scale_cam=1.6):
+    """
+    Structure and camera image of a telescope, at its position and pointing
+    :param structures: {tel_type: mesh} structures already built (updated)
+    :return: list of (name, mesh)
+    """
+    tel_type = str(event.subarray.tel[tel_id]).split(':')[0]
+    camera = event.subarray.tel[tel_id].camera
+    if tel_type not in CAMERA_OFFSET or camera.cam_id in ['CHEC']:
+        return []
+    pointing = {'alt': event.run_array_direction[1].to('deg'), 'az': event.run_array_direction[0].to('deg')}
+    origin = _translation(event.subarray.positions[tel_id].to('cm').value).dot(pointing_matrix(pointing))
+
+    if tel_type not in structures:
+        structures[tel_type] = structure_mesh(tel_type)
+    vertices, faces, colours = structures[tel_type]
+    meshes = [('telescope {0}'.format(tel_id), (transform(vertices, origin), faces, colours))]
+
+    if tel_id in event.images:
+        pixel_colours, _ = image_colours(camera, event.images[tel_id], tail_cut_bool=True)
+        vertices, faces, colours = camera_pixels(camera, pixel_colours, scale_cam=scale_cam).to_mesh()
+        matrix = origin.dot(camera_matrix(camera, tel_type, scale_cam))
+        meshes.append(('camera {0}'.format(tel_id), (transform(vertices, matrix), faces, colours)))
+    return meshes
+
+
+def encode_chunk(name, mesh):
+    """
+    One line of the stream: JSON with the base64 arrays of the mesh
+    (float32 vertices in cm, uint32 triangles, uint8 RGBA colours)
+    """
+    vertices, faces, colours = mesh
+    return (json.dumps({'name': name,
+                        'vertices': base64.b64encode(np.asarray(vertices, dtype='<f4').tobytes()).decode(),
+                        'faces': base64.b64encode(np.asarray(faces, dtype='<u4').tobytes()).decode(),
+                        'colors': base64.b64encode(
+                            (255 * np.clip(colours, 0, 1)).astype(np.uint8).tobytes()).decode()})
+            + '\n').encode()
+
+
+def load_event(filename, all_tels=False, radius=None, nearest=None, bbox=None):
+    """
+    Load and calibrate the event and select the telescopes to stream (see select_telescopes)
+    :return: event, tel_ids
+    """
+    event = load_calibrate(filename, all_tels=all_tels)
+    return event, select_telescopes(event, radius=radius, nearest=nearest, bbox=bbox)
+
+
+class SceneStreamer(object):
+    """
+    Local HTTP server streaming the scene of an event to the viewer page while it is built:
+    ground grid, telescope positions and MC core first, then the structure and camera of each telescope.
+    The server listens before the event is loaded: the loading and the meshes run in a worker thread,
+    once, and every client follows the same build.
+    Routes: / (viewer page), /stream (chunked stream of JSON meshes, one per line)
+    """
+
+    def __init__(self, load):
+        """
+        :param load: function returning (event, tel_ids), e.g. functools.partial(load_event, filename)
+        """
+        self.load = load
+        self.event = None
+        self.tel_ids = None
+        self.structures = {}
+        # chunks built so far, kept for the next requests (e.g. page reload)
+        self.chunks = []
+        self.complete = False
+        self._changed = None
+
+    def build(self):
+        """
+        Generator over the encoded chunks, in drawing order
+        """
+        for name, mesh in ground_meshes(self.event, self.tel_ids):
+            yield encode_chunk(name, mesh)
+        for tel_id in self.tel_ids:
+            for name, mesh in telescope_meshes(self.event, tel_id, self.structures):
+                yield encode_chunk(name, mesh)
+
+    async def build_all(self):
+        """
+        Load the event and build all the chunks in a worker thread, waking up the streams after each chunk.
+        Run once, as a task started with the server.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            self.event, self.tel_ids = await loop.run_in_executor(None, self.load)
+            print("event loaded in {0:.2f} s".format(time.perf_counter() - start))
+            chunks = self.build()
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                async with self._changed:
+                    self.chunks.append(chunk)
+                    self._changed.notify_all()
+            print("scene built in {0:.2f} s".format(time.perf_counter() - start))
+        except Exception as err:
+            print("FAILED to build the scene: {0!r}".format(err))
+        finally:
+            async with self._changed:
+                self.complete = True
+                self._changed.notify_all()
+
+    async def stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        # each chunk is sent as soon as build_all has it
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.chunks) > sent or self.complete)
+                chunks = self.chunks[sent:]
+            if not chunks:
+                break
+            for chunk in chunks:
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            sent += len(chunks)
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # skip the headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode(errors='replace').split()
+            path = urlparse(parts[1]).path if len(parts) > 1 else ''
+            if path == '/':
+                with open(VIEWER_PAGE, 'rb') as f:
+                    page = f.read()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\n"
+                             b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(page), page))
+            elif path == '/stream':
+                await self.stream(writer)
+            else:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host, port):
+        """
+        Listen, then start loading the event and building the scene in the background
+        :return: server, build task
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        self._changed = asyncio.Condition()
+        return server, asyncio.get_running_loop().create_task(self.build_all())
+
+    def serve(self, host='127.0.0.1', port=8000):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server, building = loop.run_until_complete(self.start(host, port))
+        print("open http://{0}:{1}/ to see the scene".format(host, port))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            building.cancel()
+            loop.run_until_complete(asyncio.gather(building, return_exceptions=True))
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream the scene of an event to a local WebGL viewer while it is built")
+    parser.add_argument('filename', help="simtel file (or synthetic source)")
+    parser.add_argument('--all-tels', action='store_true',
+                        help="read all the telescopes, not only the default layout of the site")
+    parser.add_argument('--radius', type=float, default=None,
+                        help="stream only telescopes within RADIUS meters from the MC core")
+    parser.add_argument('--nearest', type=n_telescopes, default=None,
+                        help="stream only the NEAREST telescopes closest to the MC core")
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('X_MIN', 'X_MAX', 'Y_MIN', 'Y_MAX'),
+                        help="stream only telescopes inside the box (meters)")
+    parser.add_argument('--host', default='127.0.0.1', help="address of the server")
+    parser.add_argument('--port', type=int, default=8000, help="port of the server")
+    args = parser.parse_args()
+
+    SceneStreamer(functools.partial(load_event, args.filename, all_tels=args.all_tels, radius=args.radius,
+                                    nearest=args.nearest, bbox=args.bbox)).serve(args.host, args.port)
@@ -0,0 +1,379 @@
+import numpy as np
+import astropy.units as u
+from astropy.table import Table
+from astropy.coordinates import SkyCoord
+
+from ctapipe.instrument import CameraGeometry
+from ctapipe.coordinates import GroundFrame, CameraFrame, HorizonFrame
+from ctapipe.coordinates.ground_frames import get_shower_trans_matrix
+
+from event_record import EventRecord
+
+# number of pixels and pixel spacing (m) of the cameras rendered by CREED
+CAMERAS = {'LSTCam': {'n_pixels': 1855, 'spacing': 0.05, 'tel_type': 'LST', 'focal_length': 28.0},
+           'NectarCam': {'n_pixels': 1855, 'spacing': 0.05, 'tel_type': 'MST', 'focal_length': 16.0},
+           'FlashCam': {'n_pixels': 1764, 'spacing': 0.05, 'tel_type': 'MST', 'focal_length': 16.0}}
+
+_geometries = {}
+
+
+def hex_grid(n_pixels, spacing):
+    """
+    Centers of the n_pixels hexagonal cells closest to the origin (pointy-top lattice)
+    :param n_pixels: number of pixels
+    :param spacing: distance between neighbouring pixels
+    :return: x, y arrays
+    """
+    n_rings = int(np.ceil(np.sqrt(n_pixels / 3.))) + 2
+    i, j = np.meshgrid(np.arange(-n_rings, n_rings + 1), np.arange(-n_rings, n_rings + 1))
+    x = spacing * (i + 0.5 * j).ravel()
+    y = spacing * (np.sqrt(3) / 2 * j).ravel()
+    order = np.lexsort((np.arctan2(y, x), np.round(np.hypot(x, y), 6)))[:n_pixels]
+    return x[order], y[order]
+
+
+def synthetic_camera(cam_id):
+    """
+    Camera geometry with the pixel count of a real camera on a regular hexagonal grid.
+    Geometries are built once and re-used.
+    :param cam_id: 'LSTCam', 'NectarCam' or 'FlashCam'
+    :return: CameraGeometry
+    """
+    if cam_id not in _geometries:
+        info = CAMERAS[cam_id]
+        x, y = hex_grid(info['n_pixels'], info['spacing'])
+        area = np.full(x.size, np.sqrt(3) / 2 * info['spacing'] ** 2)
+        _geometries[cam_id] = CameraGeometry(cam_id=cam_id,
+                                             pix_id=np.arange(x.size),
+                                             pix_x=x * u.m,
+                                             pix_y=y * u.m,
+                                             pix_area=area * u.m ** 2,
+                                             pix_type='hexagonal')
+    return _geometries[cam_id]
+
+
+def ellipse_image(camera, cog, length, width, psi, amplitude, rng, noise=1.0):
+    """
+    Shower-like image: 2D gaussian ellipse plus gaussian noise on each pixel
+    :param camera: camera geometry
+    :param cog: (x, y) center of the ellipse in m
+    :param length: std along the major axis in m
+    :param width: std along the minor axis in m
+    :param psi: angle of the major axis in rad
+    :param amplitude: total charge of the ellipse (p.e.)
+    :param rng: np.random.RandomState
+    :param noise: std of the gaussian noise on each pixel (p.e.)
+    :return: image (float32)
+    """
+    x = camera.pix_x.to('m').value
+    y = camera.pix_y.to('m').value
+
+    dx = x - cog[0]
+    dy = y - cog[1]
+    along = dx * np.cos(psi) + dy * np.sin(psi)
+    across = -dx * np.sin(psi) + dy * np.cos(psi)
+    ellipse = np.exp(-0.5 * ((along / length) ** 2 + (across / width) ** 2))
+    ellipse *= amplitude / ellipse.sum()
+
+    return (ellipse + rng.normal(0, noise, x.size)).astype(np.float32)
+
+
+def synthetic_image(camera, rng, amplitude=None, noise=1.0):
+    """
+    Shower-like image with random center, size and orientation.
+    :param camera: camera geometry
+    :param rng: np.random.RandomState
+    :param amplitude: total charge of the ellipse. Random if None
+    :param noise: std of the gaussian noise on each pixel (p.e.)
+    :return: image (float32)
+    """
+    radius = np.max(np.hypot(camera.pix_x.to('m').value, camera.pix_y.to('m').value))
+
+    if amplitude is None:
+        amplitude = 10 ** rng.uniform(2, 4)
+    cog = rng.uniform(-0.5, 0.5, 2) * radius
+    length = rng.uniform(0.05, 0.15) * radius
+    width = rng.uniform(0.2, 0.6) * length
+    psi = rng.uniform(0, np.pi)
+    return ellipse_image(camera, cog, length, width, psi, amplitude, rng, noise=noise)
+
+
+def pulse_waveforms(camera, image, cog, psi, n_samples, gradient=40., pulse_width=1.5):
+    """
+    Waveforms of an image: gaussian pulse with integral equal to the pixel charge, peak time
+    linear with the position along the major axis.
+    :param camera: camera geometry
+    :param image: pixel charges
+    :param cog: (x, y) center of the image in m
+    :param psi: angle of the major axis in rad
+    :param n_samples: number of samples
+    :param gradient: time gradient along the major axis (samples / m)
+    :param pulse_width: std of the pulse (samples)
+    :return: (n_pixels, n_samples) waveforms (float32)
+    """
+    x = camera.pix_x.to('m').value - cog[0]
+    y = camera.pix_y.to('m').value - cog[1]
+    peak = n_samples / 2. + gradient * (x * np.cos(psi) + y * np.sin(psi))
+    samples = np.arange(n_samples)
+    pulse = np.exp(-0.5 * ((samples[np.newaxis, :] - peak[:, np.newaxis]) / pulse_width) ** 2)
+    pulse /= np.sqrt(2 * np.pi) * pulse_width
+    return (image[:, np.newaxis] * pulse).astype(np.float32)
+
+
+class SyntheticOptics(object):
+    def __init__(self, tel_type, focal_length):
+        self.tel_type = tel_type
+        self.equivalent_focal_length = focal_length * u.m
+
+    def __str__(self):
+        return self.tel_type
+
+
+class SyntheticTelescope(object):
+    def __init__(self, cam_id):
+        info = CAMERAS[cam_id]
+        self.camera = synthetic_camera(cam_id)
+        self.optics = SyntheticOptics(info['tel_type'], info['focal_length'])
+
+    def __str__(self):
+        return str(self.optics) + ':' + self.camera.cam_id
+
+
+class SyntheticSubarray(object):
+    """
+    Subarray with the part of the SubarrayDescription interface used by CREED:
+    tel, positions, tel_ids, tel_coords, select_subarray and to_table.
+    """
+
+    def __init__(self, name, cam_ids, positions):
+        """
+        :param name: name of the subarray
+        :param cam_ids: {tel_id: cam_id}
+        :param positions: {tel_id: (x, y, z)} in meters
+        """
+        self.name = name
+        self.tel = {tel_id: SyntheticTelescope(cam_id) for tel_id, cam_id in cam_ids.items()}
+        self.positions = {tel_id: u.Quantity(pos, u.m) for tel_id, pos in positions.items()}
+
+    @property
+    def tel_ids(self):
+        return np.array(list(self.tel.keys()))
+
+    @property
+    def num_tels(self):
+        return len(self.tel)
+
+    @property
+    def tel_coords(self):
+        pos = np.array([p.to('m').value for p in self.positions.values()])
+        return GroundFrame(x=pos[:, 0] * u.m, y=pos[:, 1] * u.m, z=pos[:, 2] * u.m)
+
+    def select_subarray(self, name, tel_ids):
+        return SyntheticSubarray(name,
+                                 {tel_id: self.tel[tel_id].camera.cam_id for tel_id in tel_ids},
+                                 {tel_id: self.positions[tel_id].to('m').value for tel_id in tel_ids})
+
+    def to_table(self):
+        ids = list(self.tel.keys())
+        pos = np.array([self.positions[tel_id].to('m').value for tel_id in ids]).reshape(-1, 3)
+        return Table({'tel_id': np.array(ids),
+                      'tel_pos_x': pos[:, 0] * u.m,
+                      'tel_pos_y': pos[:, 1] * u.m,
+                      'tel_pos_z': pos[:, 2] * u.m,
+                      'tel_description': [str(self.tel[tel_id]) for tel_id in ids]})
+
+
+def synthetic_layout(n_tels, seed=0, spacing=150.):
+    """
+    Array of n_tels telescopes on a jittered square grid: the 4 central ones are LSTs,
+    the others are MSTs with NectarCam and FlashCam alternated.
+    :param n_tels: number of telescopes
+    :param seed: random seed
+    :param spacing: grid step in meters
+    :return: SyntheticSubarray
+    """
+    rng = np.random.RandomState(seed)
+    side = int(np.ceil(np.sqrt(n_tels)))
+    i, j = np.meshgrid(np.arange(side), np.arange(side))
+    grid = np.stack(((i.ravel() - (side - 1) / 2.), (j.ravel() - (side - 1) / 2.)), axis=1) * spacing
+    grid = grid[np.argsort(np.hypot(grid[:, 0], grid[:, 1]), kind='stable')][:n_tels]
+    grid += rng.uniform(-0.2, 0.2, grid.shape) * spacing
+
+    cam_ids = {}
+    positions = {}
+    for k in range(n_tels):
+        tel_id = k + 1
+        if k < 4:
+            cam_ids[tel_id] = 'LSTCam'
+        else:
+            cam_ids[tel_id] = 'NectarCam' if k % 2 else 'FlashCam'
+        positions[tel_id] = (grid[k, 0], grid[k, 1], 0.)
+    return SyntheticSubarray('synthetic_{0}'.format(n_tels), cam_ids, positions)
+
+
+def synthetic_record(subarray, seed=0, tel_ids=None, alt=70., az=0.):
+    """
+    EventRecord with a synthetic image on the given telescopes
+    :param subarray: SyntheticSubarray
+    :param seed: random seed
+    :param tel_ids: telescopes with data. None for all the telescopes
+    :param alt: pointing altitude (deg)
+    :param az: pointing azimuth (deg)
+    :return: EventRecord
+    """
+    rng = np.random.RandomState(seed)
+    if tel_ids is None:
+        tel_ids = list(subarray.tel.keys())
+    images = {tel_id: synthetic_image(subarray.tel[tel_id].camera, rng) for tel_id in tel_ids}
+    core = rng.uniform(-100, 100, 2)
+    return EventRecord(event_id=seed,
+                       tels_with_data=list(tel_ids),
+                       images=images,
+                       subarray=subarray,
+                       run_array_direction=u.Quantity([az, alt], u.deg),
+                       core_x=core[0] * u.m,
+                       core_y=core[1] * u.m)
+
+
+def tilted_to_camera(telescope, alt, az, step=1e-3):
+    """
+    Linear map from small offsets from the pointing in the tilted frame (rad) to the camera frame (m), through
+    the ctapipe frames: the synthetic images have the orientation of real images (see hillas.image_axes)
+    :param telescope: SyntheticTelescope
+    :param alt: pointing altitude (Quantity)
+    :param az: pointing azimuth (Quantity)
+    :param step: offset used to sample the map (rad)
+    :return: 2x2 matrix
+    """
+    trans = get_shower_trans_matrix(az.to('rad').value, alt.to('rad').value)
+    # sky directions at offsets (step, 0) and (0, step) in the tilted frame, in the ground frame (x north, y west)
+    ground = np.array([[step, 0., 1.], [0., step, 1.]]).dot(trans)
+    ground /= np.linalg.norm(ground, axis=1)[:, np.newaxis]
+    pointing = SkyCoord(alt=alt, az=az, frame=HorizonFrame())
+    frame = CameraFrame(focal_length=telescope.optics.equivalent_focal_length,
+                        rotation=telescope.camera.cam_rotation, telescope_pointing=pointing)
+    sky = SkyCoord(alt=np.arcsin(ground[:, 2]) * u.rad, az=np.arctan2(-ground[:, 1], ground[:, 0]) * u.rad,
+                   frame=HorizonFrame())
+    camera = sky.transform_to(frame)
+    return np.stack((camera.x.to('m').value, camera.y.to('m').value)) / step
+
+
+class _Container(object):
+    """
+    Plain attribute container, standing in for the ctapipe containers of an event
+    """
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class SyntheticEventSource(object):
+    """
+    Local stand-in for the simtel event_source: same attributes read by CREED
+    (r0.event_id, r0.tels_with_data, dl1.tel[id].image, inst.subarray, mcheader.run_array_direction,
+    mc.core_x/y), with ellipse-shaped images generated from a seed. The images are already "calibrated",
+    so is_calibrated is True and the CameraCalibrator is skipped.
+
+    Each event has a random core and brightness: the image size decreases with the distance between
+    the telescope and the core, its major axis points away from the core and its center moves towards
+    the edge of the camera for large impact distances. Telescopes with a size below trigger_pe are not triggered.
+    With n_samples > 0 the events also have dl0 waveforms: a gaussian pulse in each pixel whose peak time
+    grows along the major axis of the image, as for a real shower.
+    """
+    is_calibrated = True
+
+    # type of each option of the 'synthetic:' URL (see from_url)
+    OPTION_TYPES = {'n_tels': int, 'n_events': int, 'seed': int, 'alt': float, 'az': float,
+                    'trigger_pe': float, 'n_samples': int}
+
+    def __init__(self, n_tels=100, n_events=1000, seed=0, alt=70., az=0., trigger_pe=100., n_samples=0):
+        """
+        :param n_tels: number of telescopes of the synthetic layout (see synthetic_layout)
+        :param n_events: number of events
+        :param seed: random seed for layout and events
+        :param alt: pointing altitude (deg)
+        :param az: pointing azimuth (deg)
+        :param trigger_pe: minimum image size (p.e.) for a telescope to be triggered
+        :param n_samples: number of samples of the waveforms. 0 for no waveforms
+        """
+        self.n_events = n_events
+        self.seed = seed
+        self.run_array_direction = u.Quantity([az, alt], u.deg)
+        self.trigger_pe = trigger_pe
+        self.n_samples = n_samples
+        self.subarray = synthetic_layout(n_tels, seed=seed)
+        self.max_events = None
+        self.allowed_tels = None
+        # orientation of the images in each camera, one map for each telescope type
+        maps = {}
+        self._camera_maps = {}
+        for tel_id, telescope in self.subarray.tel.items():
+            if str(telescope) not in maps:
+                maps[str(telescope)] = tilted_to_camera(telescope, alt * u.deg, az * u.deg)
+            self._camera_maps[tel_id] = maps[str(telescope)]
+
+    @classmethod
+    def from_url(cls, url):
+        """
+        :param url: 'synthetic:' followed by comma separated options, e.g. 'synthetic:n_tels=200,n_events=5000,seed=3'
+        :return: SyntheticEventSource
+        """
+        options = {}
+        for item in url.split(':', 1)[1].split(','):
+            if item:
+                key, value = item.split('=')
+                if key not in cls.OPTION_TYPES:
+                    raise ValueError("unknown synthetic option {0}: use {1}".format(key, sorted(cls.OPTION_TYPES)))
+                number = float(value)
+                if cls.OPTION_TYPES[key] is int:
+                    # e.g. n_events=1e3
+                    if not number.is_integer():
+                        raise ValueError("synthetic option {0} must be an integer, not {1}".format(key, value))
+                    number = int(number)
+                options[key] = number
+        return cls(**options)
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed)
+        tel_ids = [tel_id for tel_id in self.subarray.tel
+                   if self.allowed_tels is None or tel_id in self.allowed_tels]
+        positions = np.array([self.subarray.positions[tel_id].to('m').value for tel_id in tel_ids]).reshape(-1, 3)
+        extent = np.max(np.abs(positions[:, :2])) + 100. if tel_ids else 100.
+        az, alt = self.run_array_direction
+        trans = get_shower_trans_matrix(az.to('rad').value, alt.to('rad').value)
+
+        n_events = self.n_events if self.max_events is None else min(self.n_events, self.max_events)
+        for event_id in range(n_events):
+            core = rng.uniform(-extent, extent, 2)
+            brightness = 10 ** rng.uniform(3, 5)
+
+            delta = positions[:, :2] - core
+            dist = np.hypot(delta[:, 0], delta[:, 1])
+            # from the core to the telescopes in the tilted frame: the images point away from the core
+            delta_tilted = (positions - np.append(core, 0.)).dot(trans.T)[:, :2]
+            size = brightness * np.exp(-dist / 150.)
+
+            tel_data = {}
+            tel_waveforms = {}
+            for k in np.flatnonzero(size > self.trigger_pe):
+                tel_id = tel_ids[k]
+                camera = self.subarray.tel[tel_id].camera
+                radius = np.max(np.hypot(camera.pix_x.to('m').value, camera.pix_y.to('m').value))
+                # the shower seen from the telescope extends towards the core (offset core - telescope)
+                direction = self._camera_maps[tel_id].dot(-delta_tilted[k])
+                direction /= max(np.linalg.norm(direction), 1e-9)
+                cog = direction * min(dist[k] / 400., 0.7) * radius
+                length = radius * (0.04 + 0.02 * np.log10(size[k] / self.trigger_pe))
+                width = length * rng.uniform(0.2, 0.5)
+                psi = np.arctan2(direction[1], direction[0])
+                image = ellipse_image(camera, cog, length, width, psi, size[k], rng)
+                tel_data[tel_id] = _Container(image=image[np.newaxis])
+                if self.n_samples > 0:
+                    waveform = pulse_waveforms(camera, image, cog, psi, self.n_samples)
+                    tel_waveforms[tel_id] = _Container(waveform=waveform[np.newaxis])
+
+            yield _Container(r0=_Container(event_id=event_id, tels_with_data=set(tel_data.keys())),
+                             dl0=_Container(tel=tel_waveforms),
+                             dl1=_Container(tel=tel_data),
+                             inst=_Container(subarray=self.subarray),
+                             mcheader=_Container(run_array_direction=self.run_array_direction),
+                             mc=_Container(core_x=core[0] * u.m, core_y=core[1] * u.m))
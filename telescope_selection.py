@@ -0,0 +1,106 @@
+import weakref
+import argparse
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class TelescopeIndex(object):
+    """
+    KD-tree over the ground positions (x, y) of all the telescopes of a subarray, used to select
+    only the telescopes that matter for an event before building any geometry.
+    Positions are in meters, as in the subarray description.
+    """
+
+    # one index for each subarray: all the events of a file share the same subarray.
+    # Weak keys: the index goes away with its subarray
+    _indices = weakref.WeakKeyDictionary()
+
+    def __init__(self, subarray):
+        self.tel_ids = np.array(list(subarray.positions.keys()))
+        positions = np.array([pos.to('m').value for pos in subarray.positions.values()])
+        self.xy = positions[:, :2]
+        self.tree = cKDTree(self.xy)
+
+    @classmethod
+    def for_subarray(cls, subarray):
+        """
+        Get the index of the subarray, building it only the first time
+        :param subarray: subarray description
+        :return: TelescopeIndex
+        """
+        if subarray not in cls._indices:
+            cls._indices[subarray] = cls(subarray)
+        return cls._indices[subarray]
+
+    def within_radius(self, center, radius):
+        """
+        :param center: (x, y) in meters, e.g. the MC core
+        :param radius: radius in meters
+        :return: IDs of the telescopes within radius from center
+        """
+        return self.tel_ids[sorted(self.tree.query_ball_point(center, radius))]
+
+    def nearest(self, center, n, among=None):
+        """
+        :param center: (x, y) in meters, e.g. the MC core
+        :param n: number of telescopes
+        :param among: consider only these telescope IDs (e.g. the ones with data). None for all
+        :return: IDs of the n telescopes closest to center, from the closest one (none for n < 1)
+        """
+        if n < 1:
+            return self.tel_ids[:0]
+        among = None if among is None else set(among)
+        k = n
+        while True:
+            k = min(k, self.tel_ids.size)
+            dist, idx = self.tree.query(center, k=k)
+            idx = np.atleast_1d(idx)
+            ids = self.tel_ids[idx[idx < self.tel_ids.size]]
+            if among is not None:
+                ids = np.array([tel_id for tel_id in ids if tel_id in among], dtype=self.tel_ids.dtype)
+            if ids.size >= n or k == self.tel_ids.size:
+                return ids[:n]
+            k *= 2
+
+    def in_box(self, x_min, x_max, y_min, y_max):
+        """
+        :return: IDs of the telescopes inside the box (meters)
+        """
+        x = self.xy[:, 0]
+        y = self.xy[:, 1]
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return self.tel_ids[inside]
+
+
+def n_telescopes(value):
+    """
+    argparse type of --nearest: number of telescopes, at least 1
+    """
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError("at least one telescope is needed, got {0}".format(value))
+    return n
+
+
+def select_telescopes(event, radius=None, nearest=None, bbox=None):
+    """
+    Select the telescopes with data in the event which pass all the given criteria.
+    With no criteria all the telescopes with data are returned; the list is empty if no telescope passes.
+    :param event: EventRecord
+    :param radius: keep telescopes within radius (meters) from the MC core
+    :param nearest: keep the N telescopes closest to the MC core
+    :param bbox: keep telescopes inside (x_min, x_max, y_min, y_max), in meters
+    :return: list of telescope IDs, in the order of event.tels_with_data
+    """
+    selected = set(event.tels_with_data)
+    index = TelescopeIndex.for_subarray(event.subarray)
+    core = (event.core_x.to('m').value, event.core_y.to('m').value)
+
+    if radius is not None:
+        selected &= set(index.within_radius(core, radius))
+    if bbox is not None:
+        selected &= set(index.in_box(*bbox))
+    if nearest is not None:
+        selected &= set(index.nearest(core, nearest, among=selected))
+
+    return [tel_id for tel_id in event.tels_with_data if tel_id in selected]
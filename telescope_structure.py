@@ -6,6 +6,34 @@ from utilities import rotation
 import numpy as np
 import sys
 
+from geometry_cache import cached_fragment
+
+# dimensions in cm, shared with the simplified meshes of stream_server.py
+
+# LST: mirror plane radius, arch (parabola y = 4/2300*x**2 for x in [-1100, 1100]) and camera frame box
+LST_MIRROR_RADIUS = 1150
+LST_ARCH_X = np.linspace(-2200/2, 2200/2, 50)
+LST_ARCH_Y = 4/2300*LST_ARCH_X**2
+LST_ARCH_RADIUS = 30
+LST_CAMERA_FRAME = [400, 400, 190]
+
+# MST structure
+MST_RADIUS = 600
+MST_HEIGHT = 1800
+MST_RATIO_CAM = 2
+# square camera frame inscribed in the top of the spiders, and its thickness
+MST_CAMERA_SIDE = 2 * (MST_RADIUS / MST_RATIO_CAM) / np.sqrt(2)
+MST_CAMERA_THICKNESS = 100
+# spiders: radius and height of their base above the mirror plane
+SPIDER_RADIUS = 20
+SPIDER_BASE = 110
+
+# height of the camera frame center above the mirror plane, where the camera display is placed
+CAMERA_OFFSET = {'LST': np.max(LST_ARCH_Y) - 200,
+                 'MST': MST_HEIGHT - 30 + SPIDER_BASE}
+
+
+@cached_fragment
 def struct_spider(height, radius_square_low, radius_square_top):
     """
     Create structure for MST and SST camera with one mirror (FOR THE MOMENT).
@@ -20,9 +48,9 @@ def struct_spider(height, radius_square_low, radius_square_top):
 
     incl_angle = 90-np.rad2deg(np.arctan(height/(radius_square_low-radius_square_top)))
 
-    spider = cylinder(h=height, r=20)
+    spider = cylinder(h=height, r=SPIDER_RADIUS)
     spider = multmatrix(m=rotation(incl_angle, 'y'))(spider)
-    spider = translate([-radius_square_low+25, 0, 110])(spider)
+    spider = translate([-radius_square_low+25, 0, SPIDER_BASE])(spider)
 
     for i in range(sides):
         structure = multmatrix(m=rotation(delta_angles, 'z'))(structure)
@@ -31,6 +59,7 @@ def struct_spider(height, radius_square_low, radius_square_top):
     return structure
 
 
+@cached_fragment
 def mirror_plane_creator(tel_type, radius):
     """
     Create a fake mirror plane and hole at center
@@ -63,9 +92,94 @@ def mirror_plane_creator(tel_type, radius):
     return mirror_plane
 
 
+def point_structure(structure, pointing):
+    """
+    Rotate a structure built along z to the pointing direction. First move in ALTITUDE and then in AZIMUTH
+    :param structure: telescope structure (or part of it) with the optical axis along z
+    :param pointing: dictionary for pointing directions in degrees above horizon, {'alt': val, 'az': val}
+    :return: rotated structure
+    """
+    structure = multmatrix(m=rotation(-90, 'z'))(structure)
+    zen = 90 - pointing['alt'].value
+    az = pointing['az'].value
+    structure = multmatrix(m=rotation(zen, 'y'))(structure)
+    structure = multmatrix(m=rotation(-az, 'z'))(structure)
+    return structure
+
+
+@cached_fragment
+def telescope_body(tel_type, pointing, ref_camera=True):
+    """
+    Structure of the telescope without the camera display, already rotated to the pointing.
+    It depends only on the telescope type and pointing, so it is built and serialised once (see cached_fragment).
+    :param tel_type: 'LST' or 'MST'
+    :param pointing: dictionary for pointing directions in degrees above horizon, {'alt': val, 'az': val}
+    :param ref_camera: (bool) create ref frame on camera
+    :return: geometry of the telescope structure
+    """
+    telescope_struct = union()
+
+    if tel_type == 'LST':
+        # create mirror plane
+        mirror_plane = mirror_plane_creator(tel_type=tel_type, radius=LST_MIRROR_RADIUS)
+
+        # define arch
+        arch = union()
+        arch_struct = color([1, 0, 0])(arco(LST_ARCH_X, LST_ARCH_Y, LST_ARCH_RADIUS))
+        arch_struct = multmatrix(m=rotation(-90, 'y'))(arch_struct)
+        arch_struct = multmatrix(m=rotation(-90, 'x'))(arch_struct)
+        arch.add(arch_struct)
+
+        # append camera frame to arch (the camera display is added by telescope())
+        camera_frame = cube(LST_CAMERA_FRAME, center=True)
+
+        # check for arrows in reference frame
+        if ref_camera:
+            arrow_camera = ref_arrow_2d(500, label={'x': "x_cam", 'y': "y_cam"}, origin=(0, 0))
+            arrow_camera = multmatrix(m=rotation(180, 'x'))(arrow_camera)
+            camera_frame = camera_frame + arrow_camera
+
+        arch.add(camera_frame)
+        arch = translate([0, 0, CAMERA_OFFSET['LST']])(arch)
+
+        # put together arch and mirror plane
+        telescope_struct.add(arch)
+        telescope_struct.add(mirror_plane)
+
+    elif tel_type == 'MST':
+        radius = MST_RADIUS
+        height = MST_HEIGHT
+        ratio_cam = MST_RATIO_CAM
+        mirror_plane = mirror_plane_creator(tel_type=tel_type, radius=radius)
+        telescope_struct.add(mirror_plane)
+
+        # add the long spiders to the structure
+        structure = struct_spider(height, radius, radius/ratio_cam)
+
+        # create camera structure with ref arrow
+        camera_frame = cube([MST_CAMERA_SIDE, MST_CAMERA_SIDE, MST_CAMERA_THICKNESS], center=True)
+
+        # check for arrows in reference frame
+        if ref_camera:
+            arrow_camera = ref_arrow_2d(500, label={'x': "x_cam", 'y': "y_cam"}, origin=(0, 0))
+            arrow_camera = multmatrix(m=rotation(180, 'x'))(arrow_camera)
+            camera_frame = camera_frame + arrow_camera
+
+        # raise to top of telescope, minus 30 cm in order to look nicer
+        camera_frame = translate([0, 0, CAMERA_OFFSET['MST']])(camera_frame)
+        structure = structure + camera_frame
+
+        # add structure and camera frame on the telescope structure
+        telescope_struct.add(structure)
+
+    return point_structure(telescope_struct, pointing)
+
+
 def telescope(tel_description, camera_display_bool, pointing, origin, tel_num='0', ref_camera=True, ref_tel=False, sim_to_real=False):
     """
     Create telescope. Implemented only 'LST' by now. Everything is somehow in centimeters.
+    The structure comes from telescope_body (cached), the camera display is placed on the camera frame
+    with the same transformations.
     :param tel_description: string for telescope type. 'LST', 'MST', ecc.
     :param camera_display_bool: input from camera_event.py loaded another event.
     :param pointing: dictionary for pointing directions in degrees above horizon, {'alt': val, 'az': val}
@@ -97,77 +211,14 @@ def telescope(tel_description, camera_display_bool, pointing, origin, tel_num='0
     camera_name = tel_description.split(':')[1]
 
     if camera_name in DC_list:
-        if tel_type == 'LST':
-            # create mirror plane
-            mirror_plane = mirror_plane_creator(tel_type=tel_type, radius=1150)
-
-            # define arch
-            arch = union()
-            x_arco = np.linspace(-2200/2, 2200/2, 50)
-            y_arco = 4/2300*x_arco**2
-            arch_struct = color([1, 0, 0])(arco(x_arco, y_arco, 30))
-            arch_struct = multmatrix(m=rotation(-90, 'y'))(arch_struct)
-            arch_struct = multmatrix(m=rotation(-90, 'x'))(arch_struct)
-            arch.add(arch_struct)
-
-            arch = translate([0, 0, np.max(y_arco) - 200])(arch)
-
-            # append camera to arch
-            camera_frame = cube([400, 400, 190], center=True)
-
-            if sim_to_real:
-                camera_display = multmatrix(m=rotation(90, 'z'))(camera_display)
-                camera_display = multmatrix(m=rotation(180, 'x'))(camera_display)
+        if tel_type in ['LST', 'MST']:
+            telescope_struct.add(telescope_body(tel_type, pointing, ref_camera=ref_camera))
 
-            # check for arrows in reference frame
-            camera_frame = camera_frame + camera_display
-
-            if ref_camera:
-                arrow_camera = ref_arrow_2d(500, label={'x': "x_cam", 'y': "y_cam"}, origin=(0, 0))
-                arrow_camera = multmatrix(m=rotation(180, 'x'))(arrow_camera)
-                camera_frame = camera_frame + arrow_camera
-
-            # ADD camera_frame and camera display to arch structure
-            arch.add(camera_frame)
-
-            # put together arch and mirror plane
-            telescope_struct.add(arch)
-            telescope_struct.add(mirror_plane)
-            # telescope_struct = translate([0, 0, 450])(telescope_struct)
-
-        elif tel_type == 'MST':
-            radius = 600
-            height = 1800
-            ratio_cam = 2
-            mirror_plane = mirror_plane_creator(tel_type=tel_type, radius=radius)
-            telescope_struct.add(mirror_plane)
-
-            # add the long spiders to the structure
-            structure = struct_spider(height, radius, radius/ratio_cam)
-
-            # create camera structure with ref arrow and overplot the event
-            side_cam = 2 * (radius/ratio_cam) / np.sqrt(2)
-            camera_frame = cube([side_cam, side_cam, 100], center=True)
             if sim_to_real:
                 camera_display = multmatrix(m=rotation(90, 'z'))(camera_display)
                 camera_display = multmatrix(m=rotation(180, 'x'))(camera_display)
-            camera_frame = camera_frame + camera_display
-
-            # check for arrows in reference frame
-            if ref_camera:
-                arrow_camera = ref_arrow_2d(500, label={'x': "x_cam", 'y': "y_cam"}, origin=(0, 0))
-                arrow_camera = multmatrix(m=rotation(180, 'x'))(arrow_camera)
-                camera_frame = camera_frame + arrow_camera
-
-            camera_frame = translate([0, 0, 110])(camera_frame)
-
-            # raise to top of telescope, minus 30 cm in order to look nicer
-            camera_frame = translate([0, 0, height - 30])(camera_frame)
-            structure = structure + camera_frame
-
-            # add structure, camera frame and camera on the telescope structure
-            telescope_struct.add(structure)
-            # telescope_struct = translate([0, 0, -150])(telescope_struct)
+            camera_display = translate([0, 0, CAMERA_OFFSET[tel_type]])(camera_display)
+            telescope_struct.add(point_structure(camera_display, pointing))
 
         elif tel_type == 'SST-1M':
             # TODO: CREATE MODEL FOR SST 1-M: re-use the MST
@@ -186,13 +237,7 @@ def telescope(tel_description, camera_display_bool, pointing, origin, tel_num='0
         print("NO tel_name FOUND")
         sys.exit()
 
-    telescope_struct = multmatrix(m=rotation(-90, 'z'))(telescope_struct)
-
-    # rotate to pointing. First move in ALTITUDE and then in AZIMUTH
-    zen = 90 - pointing['alt'].value
     az = pointing['az'].value
-    telescope_struct = multmatrix(m=rotation(zen, 'y'))(telescope_struct)
-    telescope_struct = multmatrix(m=rotation(-az, 'z'))(telescope_struct)
 
     # ADD TELESCOPE ID
     print(tel_num, tel_type)
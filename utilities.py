@@ -2,7 +2,11 @@ import numpy as np
 from solid.utils import translate, rotate, union, forward, right, up, linear_extrude
 from solid.utils import cylinder, color, text, multmatrix, cube
 
+from geometry_cache import cached_fragment
+from scene_arrays import SegmentBatch
 
+
+@cached_fragment
 def arco(x, y, radius):
     """
     Create curve from set of point. Each point is connected with a cylinder
@@ -13,20 +17,11 @@ def arco(x, y, radius):
     :param radius: dimension cylinder
     :return: curve
     """
-    arco_sum = union()
-    for i in range(x.size - 1):
-        begin = (x[i], y[i])
-        end = (x[i + 1], y[i + 1])
-        angle = np.rad2deg(np.arctan((y[i] - y[i+1])/(x[i] - x[i+1])))
-
-        heigth = length(end, begin)
-        new_cylinder = multmatrix(m=rotation(90, 'y'))(cylinder(h=heigth, r=radius))
-        new_cylinder = multmatrix(m=rotation(angle, 'z'))(new_cylinder)
-        new_cylinder = translate(list(begin))(new_cylinder)
-        arco_sum.add(new_cylinder)
-    return arco_sum
+    # one array-backed node with all the segments (see SegmentBatch.to_solid for the equivalent cylinders)
+    return SegmentBatch(x, y, radius)
 
 
+@cached_fragment
 def grid_plane(grid_unit=12, count=10, line_weight=0.1, plane='xz'):
 
     # Draws a grid of thin lines in the specified plane.  Helpful for
@@ -55,6 +50,7 @@ def grid_plane(grid_unit=12, count=10, line_weight=0.1, plane='xz'):
     return t
 
 
+@cached_fragment
 def rot_arrow(radius, angle_init, angle_end, label, text_flip=False):
     """
     Create curved arrow as 1 degree-step cylinders with a cone at the end ==> arrow
@@ -156,6 +152,7 @@ def arrow(heigth, tail, label, rotation=(0, 0, 0)):
     return arrow_inst
 
 
+@cached_fragment
 def ref_arrow_3d(arr_length, origin, label, ref_rotation=(0, 0, 0)):
     """
     Create 3-axis ref frame, with color for x, y, z
@@ -173,6 +170,7 @@ def ref_arrow_3d(arr_length, origin, label, ref_rotation=(0, 0, 0)):
     return ref_frame
 
 
+@cached_fragment
 def ref_arrow_2d(length, origin, label, ref_rotation=(0, 0), inverted = False):
     """
     Create 3-axis ref frame, with color for x,y